@@ -0,0 +1,20 @@
+from fastapi import Request
+
+from ..Services.auth_service import AuthService
+from ..Services.container import ServiceContainer
+from ..Services.story_service import StoryService
+
+
+def get_container(request: Request) -> ServiceContainer:
+    """the app's service container, set up in the lifespan"""
+    return request.app.state.container
+
+
+def get_story_service(request: Request) -> StoryService:
+    """the shared story service"""
+    return get_container(request).story_service
+
+
+def get_auth_service(request: Request) -> AuthService:
+    """the shared auth service"""
+    return get_container(request).auth_service
@@ -2,24 +2,32 @@ from typing import Any
 
 from FastAPIProject.Models.domain.story import Story
 # from FastAPIProject.Services.story_processor import StoryProcessor
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 
 from FastAPIProject.Services.story_service import StoryService
 
 from FastAPIProject.Models.api.story_models import StoryCreate
 from FastAPIProject.Services.auth_service import AuthService
+from FastAPIProject.Services.utils.auth import PasswordHashingBusy
 from FastAPIProject.Models.api.user import UserCreate, User, Token, UserLogin
+from FastAPIProject.API.story_router import get_current_user_id
+from FastAPIProject.API.dependencies import get_auth_service
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
 
 @router.post("/register", response_model=dict[str, Any])
-async def register(user_create: UserCreate):
-    auth_service = AuthService()
+async def register(user_create: UserCreate, auth_service: AuthService = Depends(get_auth_service)):
     try:
         user, token = await auth_service.register_user(user_create)
+    except PasswordHashingBusy as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "1"}
+        )
     except(Exception) as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -31,10 +39,15 @@ async def register(user_create: UserCreate):
 
 
 @router.post("/login", response_model=dict[str, Any])
-async def login_json(user_login: UserLogin):
-    auth_service = AuthService()
+async def login_json(user_login: UserLogin, auth_service: AuthService = Depends(get_auth_service)):
     try:
         token, user = await auth_service.login(user_login.email, user_login.password)
+    except PasswordHashingBusy as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "1"}
+        )
     except(Exception) as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -42,3 +55,13 @@ async def login_json(user_login: UserLogin):
         )
 
     return {"name": user.username, "email": user.email, "token": token} #{"token": token, "user": user}
+
+
+@router.post("/logout", response_model=dict[str, Any])
+async def logout(
+        current_user_id: str = Depends(get_current_user_id),
+        auth_service: AuthService = Depends(get_auth_service)
+):
+    """revoke every token of the current user"""
+    await auth_service.logout(current_user_id)
+    return {"message": "Logged out"}
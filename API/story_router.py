@@ -1,14 +1,21 @@
 import uuid
+import hashlib
+import json
 from pathlib import Path
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
+import aiofiles
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Query, Response
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
-from typing import List, Any
+from typing import List, Any, Optional
 import os
 from jose import JWTError, jwt
 
 from ..Services.story_service import StoryService
 from ..Services.auth_service import AuthService
-from ..Models.api.story_models import StoryCreate, StoryResponse
+from ..Services.job_queue import job_queue
+from .dependencies import get_auth_service, get_story_service
+from ..Services.utils.user_cache import user_cache
+from ..Models.api.story_models import StoryCreate, StoryResponse, JobResponse
 from ..config.config_loader import config
 
 import traceback
@@ -21,10 +28,15 @@ ALGORITHM = config["jwt"]["algorithm"]
 
 UPLOAD_DIR = Path(config["uploads"]["directory"])
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+MAX_UPLOAD_BYTES = config["uploads"].get("max_size_mb", 100) * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
 
-async def get_current_user_id(token: str = Depends(oauth2_scheme)) -> str:
-    """get user by token"""
+async def get_current_user_id(
+        token: str = Depends(oauth2_scheme),
+        auth_service: AuthService = Depends(get_auth_service)
+) -> str:
+    """get the user ID from the token - the user lookup and the revocation check are cached"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -39,13 +51,20 @@ async def get_current_user_id(token: str = Depends(oauth2_scheme)) -> str:
     except JWTError:
         raise credentials_exception
 
-    # get user details from db
-    auth_service = AuthService()
-    user = await auth_service.user_repository.get_user_by_username(username)
-    if user is None:
+    user_id = payload.get("uid")
+    if user_id is None:
+        # older tokens only have the username - look the user up (cached)
+        user_id = user_cache.get(username)
+        if user_id is None:
+            user_id = await auth_service.user_repository.get_user_id_by_username(username)
+            if user_id is None:
+                raise credentials_exception
+            user_cache.put(username, user_id)
+
+    if await auth_service.is_token_revoked(user_id, payload.get("iat", 0)):
         raise credentials_exception
 
-    return str(user.id)
+    return user_id
 
 
 def validate_pdf_file(file: UploadFile) -> None:
@@ -62,17 +81,54 @@ def validate_pdf_file(file: UploadFile) -> None:
             detail="File must have .pdf extension"
         )
 
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB"
+        )
 
 
-@router.post("/upload-and-create", response_model=dict[str, Any])
-async def upload_and_create_story(
-        file: UploadFile = File(...),
-        title: str = Form(None),
-        current_user_id: str = Depends(get_current_user_id)
-):
-    """upload file and create a new operation"""
-    story_service = StoryService()
+async def save_pdf_upload(file: UploadFile, file_path: Path) -> str:
+    """stream the upload to disk in chunks and return its SHA-256 hex digest"""
+    sha256 = hashlib.sha256()
+    size = 0
+
+    try:
+        async with aiofiles.open(file_path, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                # checking if the content start with PDF signature
+                if size == 0 and not chunk.startswith(b'%PDF'):
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail="Invalid PDF file format"
+                    )
+
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=f"File is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB"
+                    )
+
+                sha256.update(chunk)
+                await f.write(chunk)
+
+        if size == 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid PDF file format"
+            )
+    except BaseException:
+        # don't leave partial files behind
+        file_path.unlink(missing_ok=True)
+        raise
+
+    return sha256.hexdigest()
 
+
+async def receive_pdf_upload(file: UploadFile, title: str, user_id: str,
+                             story_service: StoryService) -> StoryCreate:
+    """validate and save an uploaded PDF, and return the story to create from it"""
     # check if the file is only PDF
     validate_pdf_file(file)
 
@@ -85,30 +141,41 @@ async def upload_and_create_story(
 
     title = title.strip()
 
-    try:
-        content = await file.read()
+    # fail fast on duplicates instead of after minutes of processing
+    if await story_service.story_exists(title, user_id):
+        raise ValueError(f"Story with title '{title}' already exists for this user")
 
-        # checking if the content start with PDF signature
-        if not content.startswith(b'%PDF'):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Invalid PDF file format"
-            )
+    # create a unique filename
+    unique_filename = f"{uuid.uuid4()}_{file.filename}"
+    file_path = UPLOAD_DIR / unique_filename
+
+    # save the file
+    file_hash = await save_pdf_upload(file, file_path)
+
+    return StoryCreate(title=title, file_path=str(file_path), file_hash=file_hash)
 
-        # create a unique filename
-        unique_filename = f"{uuid.uuid4()}_{file.filename}"
-        file_path = UPLOAD_DIR / unique_filename
 
-        # save the file
-        with open(file_path, "wb") as f:
-            f.write(content)
+def format_sse(event: str, data: Any) -> str:
+    """format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
 
-        story_create = StoryCreate(title=title, file_path=str(file_path))
-        story_data = await story_service.create_story_from_file(story_create, current_user_id)
+
+@router.post("/upload-and-create", response_model=dict[str, Any])
+async def upload_and_create_story(
+        file: UploadFile = File(...),
+        title: str = Form(None),
+        current_user_id: str = Depends(get_current_user_id),
+        story_service: StoryService = Depends(get_story_service)
+):
+    """upload file and enqueue a job that creates the story in the background"""
+
+    try:
+        story_create = await receive_pdf_upload(file, title, current_user_id, story_service)
+        job = await job_queue.submit(story_create, current_user_id)
 
         return {
-            "message": "PDF story uploaded and created successfully",
-            "story": story_data,
+            "message": "PDF story uploaded, processing started",
+            "job_id": job.id,
         }
 
     except HTTPException:
@@ -127,14 +194,83 @@ async def upload_and_create_story(
         )
 
 
+@router.post("/upload-and-stream")
+async def upload_and_stream_story(
+        file: UploadFile = File(...),
+        title: str = Form(None),
+        current_user_id: str = Depends(get_current_user_id),
+        story_service: StoryService = Depends(get_story_service)
+):
+    """upload file and stream the story as Server-Sent Events, one event per processed chapter"""
+
+    try:
+        story_create = await receive_pdf_upload(file, title, current_user_id, story_service)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    async def events():
+        async for event, data in story_service.stream_story_from_file(
+                story_create, current_user_id, executor=job_queue.stream_executor):
+            yield format_sse(event, data)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job_status(
+        job_id: str,
+        current_user_id: str = Depends(get_current_user_id)
+):
+    """get the status of a story-processing job"""
+    job = await job_queue.get_job(job_id, current_user_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found or access denied"
+        )
+
+    return JobResponse(
+        id=job.id,
+        status=job.status,
+        stage=job.stage,
+        progress=job.progress,
+        story_id=job.story_id,
+        error=job.error,
+        created_at=job.created_at,
+        updated_at=job.updated_at
+    )
+
+
 @router.get("/", response_model=List[StoryResponse])
-async def get_user_stories(current_user_id: str = Depends(get_current_user_id)):
-    """get oll stories for the current user"""
-    story_service = StoryService()
+async def get_user_stories(
+        response: Response,
+        after: Optional[str] = None,
+        limit: int = Query(50, ge=1, le=200),
+        current_user_id: str = Depends(get_current_user_id),
+        story_service: StoryService = Depends(get_story_service)
+):
+    """get a page of the stories of the current user, oldest first.
+    pass the X-Next-Cursor header of the response as `after` to get the next page"""
 
     try:
-        stories = await story_service.get_user_stories(current_user_id)
+        stories = await story_service.get_user_stories(current_user_id, after, limit)
+        if len(stories) == limit:
+            response.headers["X-Next-Cursor"] = stories[-1].id
         return stories
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -145,10 +281,10 @@ async def get_user_stories(current_user_id: str = Depends(get_current_user_id)):
 @router.get("/{story_id}", response_model=dict[str, Any])
 async def get_story(
         story_id: str,
-        current_user_id: str = Depends(get_current_user_id)
+        current_user_id: str = Depends(get_current_user_id),
+        story_service: StoryService = Depends(get_story_service)
 ):
     """get story by ID"""
-    story_service = StoryService()
 
     try:
         story = await story_service.get_story(story_id, current_user_id)
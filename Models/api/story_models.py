@@ -11,6 +11,8 @@ class EntityModel(BaseModel):
     nicknames: List[str] = []
     coref_position: List[tuple[int, int]] = []
     description: Optional[Dict] = None
+    # (chapter, first, end) ranges of coref_position
+    chapters: List[tuple[int, int, int]] = []
 
     class Config:
         populate_by_name = True
@@ -38,7 +40,9 @@ class StoryModel(BaseModel):
     paragraphs: List[str] = []
     entities: List[EntityModel] = []
     key_paragraphs: List[List[ParagraphModel]] = []
+    source_index: Optional[Dict[str, List]] = None
     file_path: Optional[str] = None
+    status: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
 
@@ -52,6 +56,21 @@ class StoryModel(BaseModel):
 class StoryCreate(BaseModel):
     title: str
     file_path: str
+    file_hash: Optional[str] = None
+
+    class Config:
+        populate_by_name = True
+
+
+class JobResponse(BaseModel):
+    id: str
+    status: str
+    stage: str
+    progress: float
+    story_id: Optional[str] = None
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
 
     class Config:
         populate_by_name = True
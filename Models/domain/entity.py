@@ -1,11 +1,16 @@
 
 class Entity:
-    def __init__(self, name: str, label: str, nicknames: list[str], coref_position :list[tuple[int, int]], description = ""):
+    __slots__ = ("name", "label", "nicknames", "coref_position", "description", "chapters")
+
+    def __init__(self, name: str, label: str, nicknames: list[str], coref_position :list[tuple[int, int]], description = "",
+                 chapters: list[tuple[int, int, int]] = None):
         self.name = name
         self.label = label
         self.nicknames = nicknames
         self.coref_position = coref_position
         self.description = description
+        # (chapter, first, end) - the range of coref_position that is in each chapter
+        self.chapters = chapters if chapters is not None else []
 
     def get_position(self):
-        return self.coref_position
\ No newline at end of file
+        return self.coref_position
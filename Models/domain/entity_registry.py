@@ -0,0 +1,46 @@
+from typing import Dict, Iterable, List, Optional
+
+from FastAPIProject.Models.domain.entity import Entity
+
+
+class EntityRegistry:
+    """the entities of a story with indexes by name and nickname (casefolded) and by label.
+    entities are referred to by their index in the story"""
+    __slots__ = ("entities", "_by_name", "_by_nickname", "_by_label")
+
+    def __init__(self, entities: Iterable[Entity] = ()):
+        self.entities: List[Entity] = []
+        self._by_name: Dict[str, int] = {}
+        self._by_nickname: Dict[str, int] = {}
+        self._by_label: Dict[str, List[int]] = {}
+        for entity in entities:
+            self.add(entity)
+
+    def __len__(self) -> int:
+        return len(self.entities)
+
+    def add(self, entity: Entity) -> int:
+        """add an entity and return its index"""
+        index = len(self.entities)
+        self.entities.append(entity)
+
+        # the first entity with a name (or nickname) wins
+        self._by_name.setdefault(entity.name.casefold(), index)
+        for nickname in entity.nicknames:
+            self._by_nickname.setdefault(nickname.casefold(), index)
+        self._by_label.setdefault(entity.label, []).append(index)
+        return index
+
+    def get(self, index: int) -> Optional[Entity]:
+        """:return the entity at the index, or None if there is no such entity"""
+        return self.entities[index] if 0 <= index < len(self.entities) else None
+
+    def by_name(self, name: str) -> Optional[Entity]:
+        """:return the entity with this name, else the entity with this nickname (case insensitive), or None"""
+        key = name.casefold()
+        index = self._by_name.get(key, self._by_nickname.get(key))
+        return self.entities[index] if index is not None else None
+
+    def with_label(self, label: str) -> List[int]:
+        """indices of the entities with the label"""
+        return self._by_label.get(label, [])
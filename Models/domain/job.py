@@ -0,0 +1,70 @@
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+
+class Job:
+    """background story-processing job and its current state"""
+    __slots__ = ("id", "user_id", "title", "file_path", "file_hash", "status", "stage", "progress", "story_id",
+                 "error", "attempts", "created_at", "updated_at")
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, job_id: str, user_id: str, title: str, file_path: str, file_hash: Optional[str] = None):
+        self.id = job_id
+        self.user_id = user_id
+        self.title = title
+        self.file_path = file_path
+        self.file_hash = file_hash
+        self.status = Job.PENDING
+        self.stage = "queued"
+        self.progress = 0.0
+        self.story_id: Optional[str] = None
+        self.error: Optional[str] = None
+        # times a worker started the job - it is started again when its worker stops (e.g. a restart)
+        self.attempts = 0
+        self.created_at = datetime.now()
+        self.updated_at = datetime.now()
+
+    def update(self, stage: str, progress: float):
+        """set the current stage and progress (0.0 - 1.0)"""
+        self.stage = stage
+        self.progress = max(0.0, min(progress, 1.0))
+        self.updated_at = datetime.now()
+
+    def start(self):
+        """mark the job as running"""
+        self.status = Job.RUNNING
+        self.update("started", 0.0)
+
+    def finish(self, story_id: str):
+        """mark the job as done with the created story"""
+        self.story_id = story_id
+        self.status = Job.DONE
+        self.update("done", 1.0)
+
+    def fail(self, error: str):
+        """mark the job as failed"""
+        self.error = error
+        self.status = Job.FAILED
+        self.update("failed", self.progress)
+
+    def is_finished(self) -> bool:
+        """check if the job is done or failed"""
+        return self.status in (Job.DONE, Job.FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """document form for storage"""
+        data = {name: getattr(self, name) for name in Job.__slots__}
+        data["_id"] = data.pop("id")
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Job":
+        job = cls(data["_id"], data["user_id"], data["title"], data["file_path"])
+        for name in Job.__slots__:
+            if name != "id" and name in data:
+                setattr(job, name, data[name])
+        return job
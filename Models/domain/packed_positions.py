@@ -0,0 +1,44 @@
+import sys
+from array import array
+from typing import Any, Iterable, List, Sequence, Tuple
+
+from bson.binary import Binary
+
+# stored layout: one version byte, then the values as little-endian int32 (or float32) - (start, end) pairs for positions
+POSITIONS_VERSION = 1
+# user-defined BSON binary subtype
+POSITIONS_SUBTYPE = 0x80
+
+
+def pack_array(values: Iterable[float], typecode: str = 'i') -> Binary:
+    """pack int32 ('i') or float32 ('f') values into a BSON binary value"""
+    packed = array(typecode, values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return Binary(bytes([POSITIONS_VERSION]) + packed.tobytes(), POSITIONS_SUBTYPE)
+
+
+def unpack_array(value: bytes, typecode: str = 'i') -> array:
+    """decode values packed by pack_array"""
+    if not value or value[0] != POSITIONS_VERSION:
+        raise ValueError(f"Unsupported positions format version: {value[0] if value else None}")
+
+    values = array(typecode)
+    values.frombytes(bytes(value[1:]))
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def pack_positions(positions: Sequence[Tuple[int, int]]) -> Binary:
+    """pack mention positions into a BSON binary value"""
+    return pack_array(offset for position in positions for offset in position)
+
+
+def unpack_positions(value: Any) -> List[Tuple[int, int]]:
+    """decode stored mention positions - packed binary, or the older array of [start, end] pairs"""
+    if not isinstance(value, (bytes, bytearray)):
+        return value
+
+    values = unpack_array(value)
+    return list(zip(values[0::2], values[1::2]))
@@ -1,6 +1,8 @@
 from FastAPIProject.Models.domain.entity import Entity
 
 class Paragraph:
+    __slots__ = ("index", "start", "end", "entities", "summary", "place", "time")
+
     def __init__(self,index: int, start: int, end: int, entities: list[int]): #, summary: str = ""):
         self.index = index
         self.start = start
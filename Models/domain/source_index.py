@@ -0,0 +1,68 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Tuple
+
+BBox = Tuple[float, float, float, float]
+
+
+class SourceIndex:
+    """sorted map from character offsets in the story text to their place in the PDF (page, block, bbox)"""
+    __slots__ = ("starts", "pages", "blocks", "bboxes")
+
+    def __init__(self):
+        self.starts = array('i')
+        self.pages = array('i')
+        self.blocks = array('i')
+        self.bboxes = array('f')  # 4 values per entry
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def add(self, start: int, page: int, block: int, bbox: BBox):
+        """add the source of the text that starts at this offset (offsets must be added in order)"""
+        self.starts.append(start)
+        self.pages.append(page)
+        self.blocks.append(block)
+        self.bboxes.extend(bbox)
+
+    def truncate(self, offset: int):
+        """drop the entries that start at or after the offset"""
+        keep = bisect_left(self.starts, offset)
+        del self.starts[keep:]
+        del self.pages[keep:]
+        del self.blocks[keep:]
+        del self.bboxes[keep * 4:]
+
+    def _entry(self, i: int) -> Tuple[int, int, BBox]:
+        return self.pages[i], self.blocks[i], tuple(self.bboxes[i * 4:i * 4 + 4])
+
+    def locate(self, offset: int) -> Optional[Tuple[int, int, BBox]]:
+        """:return (page, block, bbox) of the text at the offset"""
+        i = bisect_right(self.starts, offset) - 1
+        if i < 0:
+            return None
+        return self._entry(i)
+
+    def locate_span(self, start: int, end: int) -> List[Tuple[int, int, BBox]]:
+        """:return (page, block, bbox) of every source region that overlaps [start, end)"""
+        first = max(bisect_right(self.starts, start) - 1, 0)
+        last = bisect_left(self.starts, end)
+        return [self._entry(i) for i in range(first, last)]
+
+    def to_dict(self) -> Dict[str, list]:
+        """compact column form for storage"""
+        return {
+            "starts": self.starts.tolist(),
+            "pages": self.pages.tolist(),
+            "blocks": self.blocks.tolist(),
+            "bboxes": [round(v, 1) for v in self.bboxes],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, list]) -> "SourceIndex":
+        index = cls()
+        index.starts.extend(data.get("starts", []))
+        index.pages.extend(data.get("pages", []))
+        index.blocks.extend(data.get("blocks", []))
+        index.bboxes.extend(data.get("bboxes", []))
+        return index
@@ -1,15 +1,19 @@
 from typing import List, Tuple, Optional
 from FastAPIProject.Models.domain.entity import Entity
 from FastAPIProject.Models.domain.paragraph import Paragraph
+from FastAPIProject.Models.domain.source_index import SourceIndex
 
 
 class Story:
+    __slots__ = ("text", "chapters", "paragraphs", "entities", "keyParagraphs", "source_index")
+
     def __init__(self):
         self.text: str = ""
         self.chapters: List[Tuple[int, int]] = []
         self.paragraphs: List[Tuple[int, int]] = []
         self.entities: List[Entity] = []
         self.keyParagraphs: List[List[Paragraph]] = []
+        self.source_index: Optional[SourceIndex] = None
 
     def text_by_range(self, start: int, end: int) -> str:
         """:return text by index range"""
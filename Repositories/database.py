@@ -1,4 +1,6 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
 from typing import Optional
 
 from FastAPIProject.config.config_loader import config
@@ -20,4 +22,40 @@ class Database:
 
     @classmethod
     def get_db(cls):
-        return cls.client[cls.db_name]
\ No newline at end of file
+        return cls.client[cls.db_name]
+
+    # collection -> (keys, options) of every index the repositories rely on
+    INDEXES = {
+        "users": [
+            ([("email", ASCENDING)], {"unique": True}),
+            ([("username", ASCENDING)], {"unique": True}),
+        ],
+        "stories": [
+            ([("user_id", ASCENDING), ("title", ASCENDING)], {"unique": True}),
+            ([("user_id", ASCENDING), ("_id", ASCENDING)], {}),
+            ([("content_hash", ASCENDING)], {}),
+        ],
+        "story_texts": [([("story_id", ASCENDING), ("index", ASCENDING)], {"unique": True})],
+        "story_entities": [([("story_id", ASCENDING), ("index", ASCENDING)], {"unique": True})],
+        "story_paragraphs": [([("story_id", ASCENDING), ("chapter", ASCENDING)], {"unique": True})],
+        "story_source_index": [([("story_id", ASCENDING), ("index", ASCENDING)], {"unique": True})],
+        # finished jobs are removed after the retention period
+        "jobs": [
+            ([("status", ASCENDING), ("created_at", ASCENDING)], {}),
+            ([("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+        ],
+        # a revocation is removed once every token it rejects has expired
+        "token_revocations": [([("expires_at", ASCENDING)], {"expireAfterSeconds": 0})],
+    }
+
+    @classmethod
+    async def ensure_indexes(cls):
+        """create the indexes (existing ones are left as they are)"""
+        db = cls.get_db()
+        for collection, indexes in cls.INDEXES.items():
+            for keys, options in indexes:
+                try:
+                    await db[collection].create_index(keys, **options)
+                except OperationFailure as e:
+                    # e.g. existing duplicates block a unique index - keep serving, but say so
+                    print(f"Failed to create index {keys} on {collection}: {e}")
\ No newline at end of file
@@ -0,0 +1,69 @@
+from datetime import datetime, timezone
+from typing import Optional
+from pymongo import ASCENDING, ReturnDocument
+from .database import Database
+from FastAPIProject.Models.domain.job import Job
+
+
+class JobRepository:
+    """story-processing jobs, shared by every worker process.
+    a running job carries a heartbeat, renewed by its worker while it runs"""
+
+    def __init__(self):
+        self.db = Database.get_db()
+        self.collection = self.db.jobs
+
+    async def create_job(self, job: Job):
+        """store a new pending job"""
+        await self.collection.insert_one(job.to_dict())
+
+    async def get_job(self, job_id: str, user_id: str) -> Optional[Job]:
+        """get a job by ID for a specific user"""
+        job_data = await self.collection.find_one({"_id": job_id, "user_id": user_id})
+        if job_data:
+            return Job.from_dict(job_data)
+        return None
+
+    async def claim_next_job(self) -> Optional[Job]:
+        """mark the oldest pending job as running and return it - each job is claimed by one worker only"""
+        job_data = await self.collection.find_one_and_update(
+            {"status": Job.PENDING},
+            {
+                "$set": {"status": Job.RUNNING, "stage": "started", "progress": 0.0,
+                         "updated_at": datetime.now(), "heartbeat": datetime.now(timezone.utc)},
+                "$inc": {"attempts": 1}
+            },
+            sort=[("created_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+        if job_data:
+            return Job.from_dict(job_data)
+        return None
+
+    async def save_job(self, job: Job, expires_at: Optional[datetime] = None) -> bool:
+        """store the state of a claimed job and renew its heartbeat (finished jobs are deleted at `expires_at`).
+        :return False if the job was claimed again since, and the state was not stored"""
+        job_data = job.to_dict()
+        job_id = job_data.pop("_id")
+        job_data["heartbeat"] = datetime.now(timezone.utc)
+        if expires_at is not None:
+            job_data["expires_at"] = expires_at
+
+        result = await self.collection.update_one({"_id": job_id, "attempts": job.attempts}, {"$set": job_data})
+        return result.matched_count > 0
+
+    async def requeue_stale_jobs(self, stale_before: datetime, max_attempts: int,
+                                 expires_at: datetime) -> int:
+        """put running jobs whose heartbeat stopped before `stale_before` (their worker was stopped) back
+        in the queue, and fail the ones already started `max_attempts` times. :return the number requeued"""
+        stale = {"status": Job.RUNNING, "heartbeat": {"$lt": stale_before}}
+        await self.collection.update_many(
+            {**stale, "attempts": {"$gte": max_attempts}},
+            {"$set": {"status": Job.FAILED, "stage": "failed", "error": "The job was interrupted too many times",
+                      "updated_at": datetime.now(), "expires_at": expires_at}}
+        )
+        result = await self.collection.update_many(
+            stale,
+            {"$set": {"status": Job.PENDING, "stage": "queued", "progress": 0.0, "updated_at": datetime.now()}}
+        )
+        return result.modified_count
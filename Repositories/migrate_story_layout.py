@@ -0,0 +1,32 @@
+"""Move stories saved as one document (text, entities, key paragraphs and source index inline)
+into the split layout - and the source index of split stories saved before it had its own collection.
+
+usage: python -m FastAPIProject.Repositories.migrate_story_layout
+stories that are not migrated keep working - they are read as they are
+"""
+import asyncio
+
+from FastAPIProject.Repositories.database import Database
+from FastAPIProject.Repositories.story_repository import StoryRepository
+
+
+async def migrate():
+    await Database.connect_db()
+    try:
+        await Database.ensure_indexes()
+        repository = StoryRepository()
+
+        legacy_ids = await repository.stories_collection.find(
+            {"$or": [{"text": {"$exists": True}}, {"source_index": {"$exists": True}}]}, {"_id": 1}
+        ).to_list(length=None)
+        for i, story_id in enumerate(legacy_ids):
+            story = await repository.stories_collection.find_one({"_id": story_id["_id"]})
+            if story is not None and repository.needs_migration(story):
+                await repository.migrate_story(story)
+            print(f"Migrated {i + 1}/{len(legacy_ids)}")
+    finally:
+        await Database.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
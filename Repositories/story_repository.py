@@ -1,24 +1,155 @@
+import asyncio
+from bisect import bisect_left
 from bson import ObjectId
 from datetime import datetime
+from pymongo import ReplaceOne
+from pymongo.errors import DuplicateKeyError
 from .database import Database
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
+from FastAPIProject.Models.domain.packed_positions import pack_positions, pack_array, unpack_array
+
+# story fields stored in their own collections rather than in the story header
+PART_FIELDS = ("text", "entities", "key_paragraphs", "source_index")
+# the columns of a source index (see SourceIndex.to_dict) - the array type code and the values per entry
+SOURCE_INDEX_COLUMNS = {"starts": ('i', 1), "pages": ('i', 1), "blocks": ('i', 1), "bboxes": ('f', 4)}
+
+# header fields returned when listing stories - older documents without stored counts are counted on the server
+LIST_PROJECTION = {
+    "title": 1,
+    "user_id": 1,
+    "created_at": 1,
+    "updated_at": 1,
+    "status": 1,
+    "chapters_count": {"$ifNull": ["$chapters_count", {"$size": {"$ifNull": ["$chapters", []]}}]},
+    "entities_count": {"$ifNull": ["$entities_count", {"$size": {"$ifNull": ["$entities", []]}}]}
+}
+
 
 class StoryRepository:
     def __init__(self):
         self.db = Database.get_db()
         self.stories_collection = self.db.stories
+        # the parts of a story - linked to the header by story_id
+        self.texts_collection = self.db.story_texts
+        self.entities_collection = self.db.story_entities
+        self.paragraphs_collection = self.db.story_paragraphs
+        self.source_index_collection = self.db.story_source_index
         self.users_collection = self.db.users
+        self._part_collections = {
+            "text": self.texts_collection,
+            "entities": self.entities_collection,
+            "key_paragraphs": self.paragraphs_collection,
+            "source_index": self.source_index_collection
+        }
+
+    @staticmethod
+    def _text_chunks(text: str, chapters: List[Tuple[int, int]]) -> List[Tuple[int, str]]:
+        """split the text at the chapter boundaries into (start, chunk) - together the chunks are the whole text"""
+        bounds = sorted({0, len(text)} | {min(max(offset, 0), len(text)) for chapter in chapters for offset in chapter})
+        return [(start, text[start:end]) for start, end in zip(bounds, bounds[1:])]
+
+    @staticmethod
+    def _source_index_chunks(source_index: Optional[Dict[str, list]],
+                             chapters: List[Tuple[int, int]]) -> List[Dict[str, Any]]:
+        """split a source index at the chapter boundaries, each chunk with its columns packed"""
+        if not source_index or not source_index.get("starts"):
+            return []
+
+        starts = source_index["starts"]
+        bounds = sorted({0, len(starts)} | {bisect_left(starts, offset) for chapter in chapters for offset in chapter})
+        return [
+            {column: pack_array(source_index[column][first * width:end * width], typecode)
+             for column, (typecode, width) in SOURCE_INDEX_COLUMNS.items()}
+            for first, end in zip(bounds, bounds[1:])
+        ]
+
+    async def _insert_parts(self, story_id: ObjectId, story_data: Dict[str, Any]):
+        """save the text, entities, key paragraphs and source index of a story in their collections"""
+        texts = [
+            {"story_id": story_id, "index": i, "start": start, "text": chunk}
+            for i, (start, chunk) in enumerate(self._text_chunks(story_data.get("text", ""),
+                                                                 story_data.get("chapters", [])))
+        ]
+        entities = [
+            dict(entity, story_id=story_id, index=i) for i, entity in enumerate(story_data.get("entities", []))
+        ]
+        paragraphs = [
+            {"story_id": story_id, "chapter": i, "key_paragraphs": chapter}
+            for i, chapter in enumerate(story_data.get("key_paragraphs", []))
+        ]
+        # one entry per OCR'd word on scanned books - stored by chapter, packed
+        source_index = [
+            dict(chunk, story_id=story_id, index=i)
+            for i, chunk in enumerate(self._source_index_chunks(story_data.get("source_index"),
+                                                                story_data.get("chapters", [])))
+        ]
+
+        for collection, documents in ((self.texts_collection, texts), (self.entities_collection, entities),
+                                      (self.paragraphs_collection, paragraphs),
+                                      (self.source_index_collection, source_index)):
+            if documents:
+                await collection.insert_many(documents)
+
+    async def _delete_parts(self, story_id: ObjectId, fields=PART_FIELDS):
+        """delete the parts of a story (all of them, or the given fields)"""
+        for field in fields:
+            await self._part_collections[field].delete_many({"story_id": story_id})
+
+    async def _load_parts(self, story_id: ObjectId) -> Dict[str, Any]:
+        """read the text, entities, key paragraphs and source index of a story back from their collections.
+        the source index is left out when it has no chunks - older stories keep it in the header"""
+        texts, entities, paragraphs, source_index = await asyncio.gather(
+            self.texts_collection.find({"story_id": story_id}, {"_id": 0, "text": 1}).sort("index", 1)
+            .to_list(length=None),
+            self.entities_collection.find({"story_id": story_id}, {"_id": 0, "story_id": 0}).sort("index", 1)
+            .to_list(length=None),
+            self.paragraphs_collection.find({"story_id": story_id}, {"_id": 0, "key_paragraphs": 1})
+            .sort("chapter", 1).to_list(length=None),
+            self.source_index_collection.find({"story_id": story_id}, {"_id": 0, "story_id": 0, "index": 0})
+            .sort("index", 1).to_list(length=None)
+        )
+        for entity in entities:
+            entity.pop("index", None)
+        parts = {
+            "text": "".join(chunk["text"] for chunk in texts),
+            "entities": entities,
+            "key_paragraphs": [chapter["key_paragraphs"] for chapter in paragraphs]
+        }
+        if source_index:
+            columns = {column: [] for column in SOURCE_INDEX_COLUMNS}
+            for chunk in source_index:
+                for column, (typecode, _) in SOURCE_INDEX_COLUMNS.items():
+                    columns[column].extend(unpack_array(chunk[column], typecode))
+            # float32 does not keep the stored rounding
+            columns["bboxes"] = [round(value, 1) for value in columns["bboxes"]]
+            parts["source_index"] = columns
+        return parts
 
     async def create_story(self, story_data: Dict[str, Any], user_id: str) -> str:
-        """create a new story and associate it with a user"""
+        """create a new story and associate it with a user.
+        the text, entities, key paragraphs and source index are saved in their own collections, unless
+        the story shares the analysis of another story (source_story_id)"""
+        header = {key: value for key, value in story_data.items() if key not in PART_FIELDS}
+        # a story that shares another story's analysis comes with its counts
+        header.setdefault("chapters_count", len(story_data.get("chapters", [])))
+        header.setdefault("entities_count", len(story_data.get("entities", [])))
+        header.setdefault("processed_chapters", len(story_data.get("key_paragraphs", [])))
+
         # save creation and update times
-        story_data.update({
+        header.update({
+            "_id": ObjectId(),
             "created_at": datetime.now(),
             "updated_at": datetime.now()
         })
 
-        # save in db
-        result = await self.stories_collection.insert_one(story_data)
+        # save in db - the header goes last, so the story is never seen without its parts
+        await self._insert_parts(header["_id"], story_data)
+        try:
+            result = await self.stories_collection.insert_one(header)
+        except DuplicateKeyError:
+            # the user already has a story with this title
+            await self._delete_parts(header["_id"])
+            raise
         story_id = str(result.inserted_id)
 
         # update user with the new story
@@ -33,19 +164,124 @@ class StoryRepository:
         return story_id
 
     async def get_story_by_id(self, story_id: str) -> Optional[Dict[str, Any]]:
-        """get story by story ID"""
+        """get the full story (header and parts) by story ID"""
         try:
             story = await self.stories_collection.find_one({"_id": ObjectId(story_id)})
-            return story
         except Exception:
             return None
 
-    async def get_stories_by_user_id(self, user_id: str) -> List[Dict[str, Any]]:
-        """get all stories for a specific user"""
-        cursor = self.stories_collection.find({"user_id": user_id})
+        # documents from before the split layout keep everything inline
+        if story is None or "text" in story:
+            return story
+
+        story.update(await self._load_parts(story.get("source_story_id", story["_id"])))
+        return story
+
+    async def get_stories_by_user_id(self, user_id: str, after: Optional[str] = None,
+                                     limit: int = 50) -> List[Dict[str, Any]]:
+        """get the headers of a user's stories, oldest first, after the story with ID `after`"""
+        query: Dict[str, Any] = {"user_id": user_id}
+        if after:
+            query["_id"] = {"$gt": ObjectId(after)}
+
+        cursor = self.stories_collection.aggregate([
+            {"$match": query},
+            {"$sort": {"_id": 1}},
+            {"$limit": limit},
+            {"$project": LIST_PROJECTION}
+        ])
         stories = await cursor.to_list(length=None)
         return stories
 
+    async def get_story_by_content_hash(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        """get the header of an already processed story by the SHA-256 of its file"""
+        story = await self.stories_collection.find_one({
+            "content_hash": content_hash,
+            "status": {"$nin": ["processing", "failed"]}
+        })
+        if story is not None and self.needs_migration(story):
+            # other stories are about to share its parts - move them out of the document first
+            story = await self.migrate_story(story)
+        return story
+
+    async def append_chapter(self, story_id: str, entities: List[Dict[str, Any]],
+                             key_paragraphs: List[Dict[str, Any]],
+                             updated_entities: Optional[Dict[int, Dict[str, Any]]] = None) -> bool:
+        """add the entities and key paragraphs of the next processed chapter to a story,
+        and replace the earlier entities (by index) that the chapter added mentions to"""
+        story_oid = ObjectId(story_id)
+        # reserve the indices of the new entities and of the chapter
+        story = await self.stories_collection.find_one_and_update(
+            {"_id": story_oid},
+            {
+                "$inc": {"entities_count": len(entities), "processed_chapters": 1},
+                "$set": {"updated_at": datetime.now()}
+            },
+            projection={"entities_count": 1, "processed_chapters": 1}
+        )
+        if story is None:
+            return False
+
+        first_entity = story.get("entities_count", 0)
+        if entities:
+            await self.entities_collection.insert_many([
+                dict(entity, story_id=story_oid, index=first_entity + i) for i, entity in enumerate(entities)
+            ])
+        if updated_entities:
+            await self.entities_collection.bulk_write([
+                ReplaceOne({"story_id": story_oid, "index": index}, dict(entity, story_id=story_oid, index=index))
+                for index, entity in updated_entities.items()
+            ])
+        await self.paragraphs_collection.insert_one({
+            "story_id": story_oid,
+            "chapter": story.get("processed_chapters", 0),
+            "key_paragraphs": key_paragraphs
+        })
+        return True
+
+    @staticmethod
+    def needs_migration(story: Dict[str, Any]) -> bool:
+        """check if a story header still holds parts - a story saved as one document,
+        or a split story from before the source index had its own collection"""
+        return "text" in story or "source_index" in story
+
+    async def migrate_story(self, story: Dict[str, Any]) -> Dict[str, Any]:
+        """move the parts a story header still holds (text, entities, key paragraphs, source index) into
+        their collections. safe to run again on a story whose migration was interrupted. :return the new story header"""
+        story_oid = story["_id"]
+        await self._delete_parts(story_oid, [field for field in PART_FIELDS if field in story])
+
+        entities = []
+        for entity in story.get("entities", []):
+            positions = entity.get("coref_position", [])
+            if isinstance(positions, list):
+                entity = dict(entity, coref_position=pack_positions(positions))
+            entities.append(entity)
+        await self._insert_parts(story_oid, dict(story, entities=entities))
+
+        # split stories already have their counts
+        counts = {
+            field: value for field, value in (("chapters_count", len(story.get("chapters", []))),
+                                              ("entities_count", len(entities)),
+                                              ("processed_chapters", len(story.get("key_paragraphs", []))))
+            if field not in story
+        }
+        await self.stories_collection.update_one(
+            {"_id": story_oid},
+            {"$unset": {field: "" for field in PART_FIELDS}, "$set": counts}
+        )
+        header = {key: value for key, value in story.items() if key not in PART_FIELDS}
+        header.update(counts)
+        return header
+
+    async def set_story_status(self, story_id: str, status: str) -> bool:
+        """set the processing status of a story (processing, complete or failed)"""
+        result = await self.stories_collection.update_one(
+            {"_id": ObjectId(story_id)},
+            {"$set": {"status": status, "updated_at": datetime.now()}}
+        )
+        return result.modified_count > 0
+
     async def get_story_by_title_and_user(self, title: str, user_id: str) -> Optional[Dict[str, Any]]:
         """get story by title and user ID"""
         story = await self.stories_collection.find_one({
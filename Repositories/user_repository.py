@@ -9,6 +9,7 @@ class UserRepository:
     def __init__(self):
         self.db = Database.get_db()
         self.collection = self.db.users
+        self.revocations = self.db.token_revocations
 
     async def get_user_by_username(self, username: str) -> Optional[UserInDB]:
         """get user by username"""
@@ -17,6 +18,13 @@ class UserRepository:
             return UserInDB(**user_data)
         return None
 
+    async def get_user_id_by_username(self, username: str) -> Optional[str]:
+        """get only the ID of a user by username"""
+        user_data = await self.collection.find_one({"username": username}, {"_id": 1})
+        if user_data:
+            return str(user_data["_id"])
+        return None
+
     async def get_user_by_email(self, email: str) -> Optional[UserInDB]:
         """get user by email"""
         user_data = await self.collection.find_one({"email": email})
@@ -25,7 +33,7 @@ class UserRepository:
         return None
 
     async def create_user(self, user: UserCreate, hashed_password: str) -> UserInDB:
-        """create a new user in the db"""
+        """create a new user in the db (raises DuplicateKeyError for a taken email or username)"""
         user_data = user.model_dump(exclude={"password"})
         user_data.update({
             "hashed_password": hashed_password,
@@ -39,6 +47,14 @@ class UserRepository:
 
         return UserInDB(**user_data)
 
+    async def update_password_hash(self, user_id: str, hashed_password: str) -> bool:
+        """replace the stored password hash of a user"""
+        result = await self.collection.update_one(
+            {"_id": ObjectId(user_id)},
+            {"$set": {"hashed_password": hashed_password, "updated_at": datetime.now()}}
+        )
+        return result.modified_count > 0
+
     async def add_story_to_user(self, user_id: str, story_id: str) -> bool:
         """add story to user's story list"""
         result = await self.collection.update_one(
@@ -50,6 +66,20 @@ class UserRepository:
         )
         return result.modified_count > 0
 
+    async def revoke_tokens(self, user_id: str, revoked_at: float, expires_at: datetime):
+        """store that the tokens of the user issued until `revoked_at` (epoch seconds) are revoked,
+        until `expires_at` when they have all expired"""
+        await self.revocations.update_one(
+            {"_id": user_id},
+            {"$max": {"revoked_at": revoked_at, "expires_at": expires_at}},
+            upsert=True
+        )
+
+    async def get_tokens_revoked_at(self, user_id: str) -> float:
+        """get the time the tokens of the user were last revoked (0 if they never were)"""
+        revocation = await self.revocations.find_one({"_id": user_id}, {"revoked_at": 1})
+        return revocation["revoked_at"] if revocation else 0.0
+
     # async def remove_story_from_user(self, user_id: str, story_id: str) -> bool:
     #     """delete story from user's story list"""
     #     result = await self.collection.update_one(
@@ -1,23 +1,32 @@
-from datetime import timedelta
+import time
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 from pydantic import EmailStr
+from pymongo.errors import DuplicateKeyError
 
 from FastAPIProject.Repositories.user_repository import UserRepository
 from FastAPIProject.Models.api.user import UserInDB, UserCreate, User, Token
-from FastAPIProject.Services.utils.auth import verify_password, get_password_hash, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from FastAPIProject.Services.utils.auth import (
+    verify_and_update_password, hash_password, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
+)
+from FastAPIProject.Services.utils.user_cache import user_cache
 
 
 class AuthService:
-    def __init__(self):
-        self.user_repository = UserRepository()
+    def __init__(self, user_repository: Optional[UserRepository] = None):
+        self.user_repository = user_repository or UserRepository()
 
     async def authenticate_user(self, email: EmailStr, password: str) -> Optional[UserInDB]:
         """Authenticate user by email and password"""
         user = await self.user_repository.get_user_by_email(email)
         if not user:
             raise Exception(f"Email {email} not found")
-        if not verify_password(password, user.hashed_password):
+        valid, new_hash = await verify_and_update_password(password, user.hashed_password)
+        if not valid:
             raise Exception(f"Password {password} not correct")
+        if new_hash:
+            # the hash was made with other bcrypt settings - store it with the current ones
+            await self.user_repository.update_password_hash(str(user.id), new_hash)
         return user
 
     async def login(self, email: EmailStr, password: str) -> Optional[Token]:
@@ -28,27 +37,38 @@ class AuthService:
 
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
-            data={"sub": user.username}, expires_delta=access_token_expires
+            data={"sub": user.username, "uid": str(user.id)}, expires_delta=access_token_expires
         )
 
         return Token(access_token=access_token, token_type="bearer"), user
 
-    async def register_user(self, user_create: UserCreate) -> Optional[User]:
-        """Register a new user and return user data and access token"""
-        # check if user already exists
-        existing_email = await self.user_repository.get_user_by_email(user_create.email)
-        if existing_email:
-            raise Exception(f"User {user_create.email} already exists")
+    async def logout(self, user_id: str):
+        """revoke every token issued to the user until now - in the database, so every process rejects them"""
+        now = time.time()
+        expires_at = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        await self.user_repository.revoke_tokens(user_id, now, expires_at)
+        user_cache.revoke(user_id, now)
 
-        existing_user = await self.user_repository.get_user_by_email(user_create.username)
-        if existing_user:
-            raise Exception(f"UserName {user_create.username} already exists")
+    async def is_token_revoked(self, user_id: str, issued_at: float) -> bool:
+        """check if a token of the user issued at `issued_at` (epoch seconds) was revoked"""
+        revoked_at = user_cache.get_revocation(user_id)
+        if revoked_at is None:
+            revoked_at = await self.user_repository.get_tokens_revoked_at(user_id)
+            user_cache.put_revocation(user_id, revoked_at)
+        return revoked_at > 0 and issued_at <= revoked_at
 
+    async def register_user(self, user_create: UserCreate) -> Optional[User]:
+        """Register a new user and return user data and access token"""
         # encrypt the password
-        hashed_password = get_password_hash(user_create.password)
+        hashed_password = await hash_password(user_create.password)
 
-        # create the user in the db
-        user_in_db = await self.user_repository.create_user(user_create, hashed_password)
+        # create the user in the db - the unique indexes reject a taken email or username
+        try:
+            user_in_db = await self.user_repository.create_user(user_create, hashed_password)
+        except DuplicateKeyError as e:
+            if "username" in (e.details or {}).get("keyPattern", {}):
+                raise Exception(f"UserName {user_create.username} already exists")
+            raise Exception(f"User {user_create.email} already exists")
 
         user = User(
             _id=str(user_in_db.id),
@@ -58,7 +78,7 @@ class AuthService:
         # create access token
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
-            data={"sub": user.username}, expires_delta=access_token_expires
+            data={"sub": user.username, "uid": str(user.id)}, expires_delta=access_token_expires
         )
         token = Token(access_token=access_token, token_type="bearer")
 
@@ -0,0 +1,20 @@
+from FastAPIProject.Repositories.job_repository import JobRepository
+from FastAPIProject.Repositories.story_repository import StoryRepository
+from FastAPIProject.Repositories.user_repository import UserRepository
+from FastAPIProject.Services.auth_service import AuthService
+from FastAPIProject.Services.story_processor import StoryProcessor
+from FastAPIProject.Services.story_service import StoryService
+
+
+class ServiceContainer:
+    """the repositories and services shared by every request for the lifetime of the app.
+    created in the app lifespan, after the database is connected (see API/dependencies.py).
+    the NLP models, TextRanker included, are shared through the model registry"""
+
+    def __init__(self):
+        self.story_repository = StoryRepository()
+        self.user_repository = UserRepository()
+        self.job_repository = JobRepository()
+        self.story_processor = StoryProcessor()
+        self.story_service = StoryService(self.story_repository, self.story_processor)
+        self.auth_service = AuthService(self.user_repository)
@@ -0,0 +1,143 @@
+import asyncio
+import os
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from FastAPIProject.config.config_loader import config
+from FastAPIProject.Models.domain.job import Job
+from FastAPIProject.Models.api.story_models import StoryCreate
+from FastAPIProject.Repositories.job_repository import JobRepository
+from FastAPIProject.Services.story_service import StoryService
+
+
+class JobQueue:
+    """queue of story-processing jobs, executed by a pool of workers off the event loop.
+    the jobs are kept in the database: any worker process takes the next pending job and stores its progress,
+    any process answers its status, and jobs left by a stopped process are started again"""
+
+    def __init__(self, workers: int = 1, retention_minutes: int = 60, stream_workers: int = 2,
+                 poll_seconds: float = 2.0, stale_seconds: float = 60.0, max_attempts: int = 3):
+        self.workers = workers
+        self.retention = timedelta(minutes=retention_minutes)
+        # idle workers look for jobs of other processes, and running jobs store their progress, this often
+        self.poll_seconds = poll_seconds
+        # a running job whose progress was not stored for this long lost its worker
+        self.stale_after = timedelta(seconds=stale_seconds)
+        self.max_attempts = max_attempts
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="story-job")
+        # streamed uploads have a user waiting - they get their own threads, never queued behind jobs
+        self.stream_executor = ThreadPoolExecutor(max_workers=stream_workers, thread_name_prefix="story-stream")
+        self._tasks: List[asyncio.Task] = []
+        self._story_service: Optional[StoryService] = None
+        self._job_repository: Optional[JobRepository] = None
+        # set when this process submits a job, so an idle worker takes it without waiting for the next poll
+        self._submitted: Optional[asyncio.Event] = None
+
+    async def start(self, story_service: Optional[StoryService] = None,
+                    job_repository: Optional[JobRepository] = None):
+        """start the worker tasks (called from the app lifespan with the app's story service and job repository)"""
+        self._story_service = story_service or StoryService()
+        self._job_repository = job_repository or JobRepository()
+        self._submitted = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """cancel the worker tasks and shut down the pool"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.stream_executor.shutdown(wait=False, cancel_futures=True)
+
+    async def submit(self, story_create: StoryCreate, user_id: str) -> Job:
+        """enqueue a new job and return it immediately"""
+        if self._job_repository is None:
+            raise RuntimeError("Job queue is not running")
+
+        job = Job(str(uuid.uuid4()), user_id, story_create.title, story_create.file_path, story_create.file_hash)
+        await self._job_repository.create_job(job)
+        self._submitted.set()
+        return job
+
+    async def get_job(self, job_id: str, user_id: str) -> Optional[Job]:
+        """get a job by ID for a specific user - whichever process runs it"""
+        return await self._job_repository.get_job(job_id, user_id)
+
+    def _expires_at(self) -> datetime:
+        """when a job finished now is deleted"""
+        return datetime.now(timezone.utc) + self.retention
+
+    async def _next_job(self) -> Job:
+        """wait for a pending job and claim it"""
+        while True:
+            self._submitted.clear()
+            job = await self._job_repository.claim_next_job()
+            if job is not None:
+                return job
+
+            stale_before = datetime.now(timezone.utc) - self.stale_after
+            if await self._job_repository.requeue_stale_jobs(stale_before, self.max_attempts, self._expires_at()):
+                continue
+            try:
+                await asyncio.wait_for(self._submitted.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _report_progress(self, job: Job):
+        """store the progress of a running job every few seconds - which also tells that its worker is alive"""
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                await self._job_repository.save_job(job)
+            except Exception as e:
+                print(f"Failed to store the progress of job {job.id}: {e}")
+
+    async def _run(self, job: Job):
+        """run a claimed job and store how it ended"""
+        reporter = asyncio.create_task(self._report_progress(job))
+        try:
+            story_create = StoryCreate(title=job.title, file_path=job.file_path, file_hash=job.file_hash)
+            story = await self._story_service.create_story_from_file(
+                story_create, job.user_id, progress=job.update, executor=self.executor
+            )
+            job.finish(str(story["_id"]))
+        except Exception as e:
+            traceback.print_exc()
+            job.fail(str(e))
+            # no story was created from the upload - don't keep it
+            if os.path.exists(job.file_path):
+                os.remove(job.file_path)
+        finally:
+            reporter.cancel()
+
+        try:
+            await self._job_repository.save_job(job, expires_at=self._expires_at())
+        except Exception:
+            traceback.print_exc()
+
+    async def _worker(self):
+        """take pending jobs and run them one at a time"""
+        while True:
+            try:
+                job = await self._next_job()
+            except Exception:
+                # e.g. the database is unreachable - try again later
+                traceback.print_exc()
+                await asyncio.sleep(self.poll_seconds)
+                continue
+            await self._run(job)
+
+
+# Global job queue instance
+job_queue = JobQueue(
+    workers=config.get("jobs", {}).get("workers", 1),
+    retention_minutes=config.get("jobs", {}).get("retention_minutes", 60),
+    stream_workers=config.get("jobs", {}).get("stream_workers", 2),
+    poll_seconds=config.get("jobs", {}).get("poll_seconds", 2.0),
+    stale_seconds=config.get("jobs", {}).get("stale_seconds", 60.0),
+    max_attempts=config.get("jobs", {}).get("max_attempts", 3)
+)
@@ -1,44 +1,79 @@
 import fitz  # PyMuPDF
-import pytesseract
-from PIL import Image
-import io
 from statistics import mean
-from typing import List, Tuple
+from typing import List, Tuple, Callable, Optional, Iterator, Any
 
 from FastAPIProject.Models.domain.story import Story
 from FastAPIProject.Models.domain.entity import Entity
+from FastAPIProject.Models.domain.entity_registry import EntityRegistry
 from FastAPIProject.Models.domain.paragraph import Paragraph
-from FastAPIProject.Services.utils.ner import coref_model, entity_extraction
+from FastAPIProject.Models.domain.source_index import SourceIndex
+from FastAPIProject.Services.utils.ner import entity_extraction, get_place_and_time
+from FastAPIProject.Services.utils.entity_consolidation import EntityConsolidator
 from FastAPIProject.Services.utils.pegasus_xsum import abstractive_summarization
-import textranker
-from textranker import TextRanker,Interval, IntervalTree
+from FastAPIProject.Services.utils.pdf_extraction import (
+    PageContent, PARALLEL_MIN_PAGES, read_page_content, read_pages_parallel, run_pending_ocr
+)
+from FastAPIProject.Services.utils.text_builder import TextBuilder
+from FastAPIProject.Services.utils.model_registry import models
+from textranker import TextRanker
 
-from Services.utils.ner import get_place_and_time
+models.register("textranker", TextRanker)
 
 
 class StoryProcessor:
     """proccess story and extract text, entities and key paragraphs"""
 
-    def __init__(self):
-        self.text_ranker = TextRanker()
+    def create_story_from_file(self, path: str, progress: Optional[Callable[[str, float], None]] = None) -> Story:
+        """create a Story object from a file path, reporting (stage, progress) to the optional callback"""
+        report = progress or (lambda stage, value: None)
 
-    def create_story_from_file(self, path: str) -> Story:
-        """create a Story object from a file path"""
         story = Story()
-        story.text, story.chapters, story.paragraphs = self.extract_text(path)
+        report("extracting_text", 0.0)
+        story.text, story.chapters, story.paragraphs, story.source_index = self.extract_text(path)
+        report("extracting_entities", 0.2)
         story.entities = self.extract_entities(story)
-        story.keyParagraphs = self.extract_key_paragraphs(story)
+        report("extracting_key_paragraphs", 0.6)
+        story.keyParagraphs = self.extract_key_paragraphs(
+            story, lambda done, total: report("extracting_key_paragraphs", 0.6 + 0.35 * done / total)
+        )
         return story
 
-    def extract_text(self, path: str) -> Tuple[str, List[Tuple[int, int]], List[Tuple[int, int]]]:
-        """extract text from a file and return the plain text, chapters and paragraphs"""
+    def iter_story_from_file(self, path: str) -> Iterator[Tuple[str, Any]]:
+        """create a Story chapter by chapter. yields ("story", story) once the text is extracted, then
+        ("chapter", (index, new_entities, updated_entities, key_paragraphs)) as soon as each chapter is processed,
+        where updated_entities maps the index of each earlier entity that the chapter added mentions to.
+        key paragraphs are ranked against the entities found up to and including their chapter"""
+        story = Story()
+        story.text, story.chapters, story.paragraphs, story.source_index = self.extract_text(path)
+        yield "story", story
+
+        consolidator = EntityConsolidator(story.entities)
+        for i, (chapter_start, chapter_end) in enumerate(story.chapters):
+            chapter_text = story.text_by_range(chapter_start, chapter_end)
+
+            first_new_entity = len(story.entities)
+            entity_extraction([chapter_text], consolidator, first_chapter=i)
+            updated_entities = {
+                index: entity for index, entity in enumerate(story.entities[:first_new_entity])
+                if entity.chapters and entity.chapters[-1][0] == i
+            }
+
+            entities_positions = [e.get_position() for e in story.entities if e.get_position()]
+            chapter_paragraphs = self.summarize_chapter(story, chapter_text, entities_positions, story.paragraphs,
+                                                        EntityRegistry(story.entities))
+            story.keyParagraphs.append(chapter_paragraphs)
+
+            yield "chapter", (i, story.entities[first_new_entity:], updated_entities, chapter_paragraphs)
+
+    def extract_text(self, path: str) -> Tuple[str, List[Tuple[int, int]], List[Tuple[int, int]], SourceIndex]:
+        """extract text from a file and return the plain text, chapters, paragraphs and source index"""
         if path.endswith(".pdf"):
-            return self.text_from_pdf(path)
+            return self.text_and_index_from_pdf(path)
         else:
             raise Exception("Unsupported file format")
 
-    def _extract_text_from_blocks(self, blocks, continuous_text: str, paragraphs: list,
-                                  current_paragraph_start: int, prev_block) -> Tuple:
+    def _extract_text_from_blocks(self, blocks, text: TextBuilder, paragraphs: list,
+                                  current_paragraph_start: int, prev_block, page_number: int) -> Tuple:
         """text extraction from blocks"""
         blocks = sorted(blocks, key=lambda b: (b[1], b[0]))
         text_elements = []
@@ -49,32 +84,28 @@ class StoryProcessor:
                 continue
 
             if prev_block is not None and block[1] > prev_block[3] and block[0] >= prev_block[2]:
-                if len(continuous_text) > current_paragraph_start:
-                    paragraphs.append((current_paragraph_start, len(continuous_text)))
-                current_paragraph_start = len(continuous_text)
+                if len(text) > current_paragraph_start:
+                    paragraphs.append((current_paragraph_start, len(text)))
+                current_paragraph_start = len(text)
 
-            continuous_text += text_content + " "
+            text.append(text_content + " ", page_number, block[5], (block[0], block[1], block[2], block[3]))
             text_elements.append((block[0], block[1], text_content))
             prev_block = block
 
-        return continuous_text, paragraphs, current_paragraph_start, prev_block, text_elements
+        return text, paragraphs, current_paragraph_start, prev_block, text_elements
 
     def extract_entities(self, story: Story) -> List[Entity]:
         """entities extraction"""
         chapter_texts = [story.text_by_range(start, end) for start, end in story.chapters]
         return entity_extraction(chapter_texts)
 
-    def _extract_text_with_ocr(self, page, continuous_text: str, paragraphs: list,
-                               current_paragraph_start: int, last_y) -> tuple[str, list, int, float, list]:
-        """extract text using OCR when no blocks are available"""
-        pix = page.get_pixmap()
-        img = Image.open(io.BytesIO(pix.tobytes()))
-        data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT)
-        img.close()
-
+    def _extract_text_with_ocr(self, data: dict, text: TextBuilder, paragraphs: list,
+                               current_paragraph_start: int, last_y,
+                               page_number: int) -> tuple[TextBuilder, list, int, float, list]:
+        """extract text from the OCR word boxes of a page with no text blocks"""
         n_boxes = len(data['level'])
         if n_boxes == 0:
-            return continuous_text, paragraphs, current_paragraph_start, last_y, []
+            return text, paragraphs, current_paragraph_start, last_y, []
 
         heights = [data['height'][i] for i in range(n_boxes) if data['height'][i] > 0]
         avg_font_size = mean(heights) if heights else 12
@@ -90,65 +121,93 @@ class StoryProcessor:
 
             # check if this is a new paragraph based on y position
             if last_y is not None and abs(y - last_y) >= avg_font_size * 1.1:
-                if len(continuous_text) > current_paragraph_start:
-                    txt = continuous_text[current_paragraph_start:].split()
-
+                if len(text) > current_paragraph_start:
                     # if the paragraph is too short, skip it
-                    if len(txt) < 10:
-                        continuous_text = continuous_text[:current_paragraph_start]
+                    if text.words_since(current_paragraph_start) < 10:
+                        text.truncate(current_paragraph_start)
                         continue
 
                     # end the current paragraph if it has content
-                    paragraphs.append((current_paragraph_start, len(continuous_text)))
+                    paragraphs.append((current_paragraph_start, len(text)))
                 # start a new paragraph
-                current_paragraph_start = len(continuous_text)
+                current_paragraph_start = len(text)
 
             # add the text content to the continuous text
-            continuous_text += text_content.strip() + " "
+            bbox = (x, y, x + data['width'][i], y + data['height'][i])
+            text.append(text_content.strip() + " ", page_number, data['block_num'][i], bbox)
             text_elements.append((x, y, text_content))
             last_y = y
 
-        return continuous_text, paragraphs, current_paragraph_start, last_y, text_elements
+        return text, paragraphs, current_paragraph_start, last_y, text_elements
 
-    def _process_single_page(self, page, continuous_text: str, paragraphs: list,
+    def _process_single_page(self, content: PageContent, page_number: int, text: TextBuilder, paragraphs: list,
                              current_paragraph_start: int, last_y, prev_block) -> tuple[
-        list, str, list, int, float, object]:
-        """process a single page - choose between regular extraction and OCR"""
+        list, TextBuilder, list, int, float, object]:
+        """process the content of a single page - regular blocks or OCR word boxes"""
         page_text_elements = []
+        kind, payload = content
 
         try:
-            blocks = page.get_text("blocks")
-            if not blocks:
+            if kind == "error":
+                raise Exception(payload)
+            elif kind == "ocr":
                 # OCR
-                continuous_text, paragraphs, current_paragraph_start, last_y, page_text_elements = \
-                    self._extract_text_with_ocr(page, continuous_text, paragraphs, current_paragraph_start, last_y)
+                text, paragraphs, current_paragraph_start, last_y, page_text_elements = \
+                    self._extract_text_with_ocr(payload, text, paragraphs, current_paragraph_start,
+                                                last_y, page_number)
             else:
                 # automatic extraction
-                continuous_text, paragraphs, current_paragraph_start, prev_block, page_text_elements = \
-                    self._extract_text_from_blocks(blocks, continuous_text, paragraphs, current_paragraph_start,
-                                                   prev_block)
+                text, paragraphs, current_paragraph_start, prev_block, page_text_elements = \
+                    self._extract_text_from_blocks(payload, text, paragraphs, current_paragraph_start,
+                                                   prev_block, page_number)
 
         except Exception as e:
             print(f"Error extracting text from page: {e}")
 
-        return page_text_elements, continuous_text, paragraphs, current_paragraph_start, last_y, prev_block
+        return page_text_elements, text, paragraphs, current_paragraph_start, last_y, prev_block
 
-    def text_from_pdf(self, pdf_path: str) -> tuple[str, list[tuple[int, int]], list[tuple[int, int]]]:
-        """extract text from PDF file with paragraph and chapter detection"""
+    def _read_pdf_pages(self, pdf_path: str, parallel: Optional[bool]) -> List[PageContent]:
+        """read the raw content of every page, in a process pool for long documents, then OCR
+        the pages without text blocks in the OCR pool"""
         doc = fitz.open(pdf_path)
+        try:
+            if parallel is None:
+                parallel = doc.page_count >= PARALLEL_MIN_PAGES
+            if not parallel:
+                contents = [read_page_content(page) for page in doc]
+            page_count = doc.page_count
+        finally:
+            doc.close()
+
+        if parallel:
+            contents = read_pages_parallel(pdf_path, page_count)
+        return run_pending_ocr(pdf_path, contents)
+
+    def text_from_pdf(self, pdf_path: str, parallel: Optional[bool] = None) -> tuple[
+        str, list[tuple[int, int]], list[tuple[int, int]]]:
+        """extract text from PDF file with paragraph and chapter detection.
+        parallel=None reads page ranges in a process pool only for long documents; the
+        page contents are then stitched in order, so the result is identical to the serial mode"""
+        plain_text, chapters, paragraphs, _ = self.text_and_index_from_pdf(pdf_path, parallel)
+        return plain_text, chapters, paragraphs
+
+    def text_and_index_from_pdf(self, pdf_path: str, parallel: Optional[bool] = None) -> tuple[
+        str, list[tuple[int, int]], list[tuple[int, int]], SourceIndex]:
+        """like text_from_pdf, plus the index from text offsets to (page, block, bbox)"""
+        page_contents = self._read_pdf_pages(pdf_path, parallel)
         text_elements = [(0.0, 0.0, "\0")]
         last_y = None
         prev_block = None
 
-        # save the continuous text for exact indexing
-        continuous_text = ""
+        # build the continuous text for exact indexing
+        text = TextBuilder()
         paragraphs = []
         current_paragraph_start = 0
 
         # procces al the pages in the PDF
-        for page in doc:
-            page_elements, continuous_text, paragraphs, current_paragraph_start, last_y, prev_block = \
-                self._process_single_page(page, continuous_text, paragraphs, current_paragraph_start, last_y,
+        for page_number, content in enumerate(page_contents):
+            page_elements, text, paragraphs, current_paragraph_start, last_y, prev_block = \
+                self._process_single_page(content, page_number, text, paragraphs, current_paragraph_start, last_y,
                                           prev_block)
 
             text_elements.extend(page_elements)
@@ -156,12 +215,10 @@ class StoryProcessor:
             text_elements.append((0.0, 0.0, "\0"))
 
         # end of the last paragraph
-        if len(continuous_text) > current_paragraph_start:
-            paragraphs.append((current_paragraph_start, len(continuous_text)))
-
-        doc.close()
+        if len(text) > current_paragraph_start:
+            paragraphs.append((current_paragraph_start, len(text)))
 
-        plain_text = continuous_text.strip()
+        plain_text = text.build().strip()
 
         # extract chapter as indices
         chapters = self.extract_chapters_as_indices(text_elements, plain_text, 17)
@@ -169,7 +226,7 @@ class StoryProcessor:
         if not chapters and plain_text:
             chapters = [(0, len(plain_text))]
 
-        return plain_text, chapters, paragraphs
+        return plain_text, chapters, paragraphs, text.index
 
     def extract_chapters_as_indices(self, text_elements: list[tuple[float, float, str]],
                                     plain_text: str, avg_line_height: float) -> list[tuple[int, int]]:
@@ -233,31 +290,38 @@ class StoryProcessor:
 
         return chapters
 
-    def extract_key_paragraphs(self, story: Story) -> List[List[Paragraph]]:
-        """extract key paragraphs from the story"""
+    def extract_key_paragraphs(self, story: Story,
+                               on_chapter: Optional[Callable[[int, int], None]] = None) -> List[List[Paragraph]]:
+        """extract key paragraphs from the story, calling on_chapter(done, total) after each chapter"""
         key_paragraphs = []
         entities_positions = [e.get_position() for e in story.entities if e.get_position()]
+        registry = EntityRegistry(story.entities)
 
         for i, (chapter_start, chapter_end) in enumerate(story.chapters):
             chapter_text = story.text_by_range(chapter_start, chapter_end)
-            chapter_paragraphs = self.summarize_chapter(story, chapter_text, entities_positions, story.paragraphs)
+            chapter_paragraphs = self.summarize_chapter(story, chapter_text, entities_positions, story.paragraphs,
+                                                        registry)
             key_paragraphs.append(chapter_paragraphs)
+            if on_chapter:
+                on_chapter(i + 1, len(story.chapters))
 
         return key_paragraphs
 
 
     def summarize_chapter(self, story: Story, chapter: str, entities: List[List[Tuple[int, int]]],
-                          paragraphs: List[Tuple[int, int]]) -> List[Paragraph]:
+                          paragraphs: List[Tuple[int, int]],
+                          registry: Optional[EntityRegistry] = None) -> List[Paragraph]:
         """summarize the chapter and extract key paragraphs"""
-        kp = self.text_ranker.ExtractKeyParagraphs(
-            chapter, paragraphs, entities, int(len(paragraphs) * 0.65)
-        )
+        registry = registry if registry is not None else EntityRegistry(story.entities)
+        with models.using("textranker") as text_ranker:
+            kp = text_ranker.ExtractKeyParagraphs(
+                chapter, paragraphs, entities, int(len(paragraphs) * 0.65)
+            )
         orgenized_kp = []
         for index, entities in kp.items():
             start, end = story.paragraphs[index][0], story.paragraphs[index][1]
-            ents_objects = [story.entities[e] for e in entities if e < len(story.entities)]
             para = Paragraph(index, start, end, entities)
-            para.place, para.time = get_place_and_time(ents_objects)
+            para.place, para.time = get_place_and_time(entities, registry)
             orgenized_kp.append(para)
 
         orgenized_kp = self.summarize_chapter_abstractive(story, chapter, orgenized_kp)
@@ -2,19 +2,36 @@ from FastAPIProject.Models.domain.story import Story
 from FastAPIProject.Services.story_processor import StoryProcessor
 from FastAPIProject.Models.domain.entity import Entity
 from FastAPIProject.Models.domain.paragraph import Paragraph
+from FastAPIProject.Models.domain.packed_positions import pack_positions, unpack_positions
 from FastAPIProject.Repositories.story_repository import StoryRepository
 from FastAPIProject.Models.api.story_models import StoryModel, EntityModel, ParagraphModel, StoryResponse, StoryCreate
-from typing import List, Optional, Dict, Any
+from FastAPIProject.Services.utils.rate_limiter import request_priority, INTERACTIVE
+from typing import List, Optional, Dict, Any, Callable, AsyncIterator, Tuple
+from concurrent.futures import Executor
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+import asyncio
+import contextvars
+import hashlib
 import os
+import traceback
+
+
+# story header fields that describe the processing output and can be shared between identical uploads -
+# the text, entities, key paragraphs and source index themselves are shared through source_story_id
+ANALYSIS_FIELDS = ("chapters", "paragraphs", "entities_count", "processed_chapters")
+
+# keep references to running stream tasks so they are not garbage collected
+_stream_tasks = set()
 
 
 class StoryService:
     """Service for managing stories, including creation and retrieval"""
 
-    def __init__(self):
-        self.story_repository = StoryRepository()
-        self.story_processor = StoryProcessor()
+    def __init__(self, story_repository: Optional[StoryRepository] = None,
+                 story_processor: Optional[StoryProcessor] = None):
+        self.story_repository = story_repository or StoryRepository()
+        self.story_processor = story_processor or StoryProcessor()
 
     def _convert_objectid_to_string(self, data: Any) -> Any:
         """convert ObjectId to string recursively"""
@@ -34,9 +51,16 @@ class StoryService:
             label=entity.label,
             nicknames=entity.nicknames if hasattr(entity, 'nicknames') else [],
             coref_position=entity.coref_position if hasattr(entity, 'coref_position') else [],
+            chapters=entity.chapters if hasattr(entity, 'chapters') else [],
             description=entity.description if isinstance(entity.description, dict) else {},
         )
 
+    def _entity_to_document(self, entity: Entity) -> dict:
+        """convert Entity to its stored form - the mention positions packed as int32 binary"""
+        document = self._entity_to_model(entity).dict()
+        document["coref_position"] = pack_positions(entity.coref_position)
+        return document
+
     def _paragraph_to_model(self, paragraph: Paragraph) -> ParagraphModel:
         """covert Paragraph to database model"""
         return ParagraphModel(
@@ -49,12 +73,29 @@ class StoryService:
             time=paragraph.time if hasattr(paragraph, 'time') else None
         )
 
+    def _file_sha256(self, path: str) -> str:
+        """hash the file contents in chunks"""
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def _copy_analysis(self, source: Dict[str, Any], title: str, file_path: str, user_id: str,
+                       content_hash: str) -> dict:
+        """build a new story header that reuses the analysis of an identical file"""
+        story_data = {field: source[field] for field in ANALYSIS_FIELDS if field in source}
+        story_data.update({
+            "source_story_id": source.get("source_story_id", source["_id"]),
+            "user_id": user_id,
+            "title": title,
+            "file_path": file_path,
+            "content_hash": content_hash
+        })
+        return story_data
+
     def _story_to_model(self, story: Story, title: str, file_path: str, user_id: str) -> dict:
         """convert Story to database model"""
-        entities = []
-        if story.entities:
-            entities = [self._entity_to_model(entity) for entity in story.entities]
-
         key_paragraphs = []
         if story.keyParagraphs:
             for chapter_paragraphs in story.keyParagraphs:
@@ -67,33 +108,54 @@ class StoryService:
             "text": story.text,
             "chapters": story.chapters,
             "paragraphs": story.paragraphs,
-            "entities": [entity.dict() for entity in entities],
+            "entities": [self._entity_to_document(entity) for entity in story.entities],
             "key_paragraphs": [[paragraph.dict() for paragraph in chapter] for chapter in key_paragraphs],
-            "file_path": file_path
+            "source_index": story.source_index.to_dict() if story.source_index else None,
+            "file_path": file_path,
+            "status": "complete"
         }
 
-    async def create_story_from_file(self, story_create: StoryCreate, user_id: str) -> Dict[str, Any]:
-        """create a new story from a file"""
+    async def _insert_story(self, story_data: Dict[str, Any], user_id: str) -> str:
+        """save a new story - the unique (user_id, title) index rejects duplicate titles"""
+        try:
+            return await self.story_repository.create_story(story_data, user_id)
+        except DuplicateKeyError:
+            raise ValueError(f"Story with title '{story_data['title']}' already exists for this user")
+
+    async def create_story_from_file(self, story_create: StoryCreate, user_id: str,
+                                     progress: Optional[Callable[[str, float], None]] = None,
+                                     executor: Optional[Executor] = None) -> Dict[str, Any]:
+        """create a new story from a file, running the processing in the given executor (off the event loop)"""
         if not os.path.exists(story_create.file_path):
             raise FileNotFoundError(f"File not found: {story_create.file_path}")
 
-        # if the story already exists for the user, raise an error
-        existing_story = await self.story_repository.get_story_by_title_and_user(
-            story_create.title, user_id
-        )
-        if existing_story:
-            raise ValueError(f"Story with title '{story_create.title}' already exists for this user")
-
         try:
-            # create a Story object from the file using StoryProcessor
-            story = self.story_processor.create_story_from_file(story_create.file_path)
+            loop = asyncio.get_running_loop()
+            content_hash = story_create.file_hash or await loop.run_in_executor(
+                executor, self._file_sha256, story_create.file_path
+            )
+
+            # the same PDF was already processed - reuse its analysis instead of running the models again
+            analyzed_story = await self.story_repository.get_story_by_content_hash(content_hash)
+            if analyzed_story:
+                story_data = self._copy_analysis(
+                    analyzed_story, story_create.title, story_create.file_path, user_id, content_hash
+                )
+            else:
+                # create a Story object from the file using StoryProcessor
+                story = await loop.run_in_executor(
+                    executor, self.story_processor.create_story_from_file, story_create.file_path, progress
+                )
 
-            if story.is_empty():
-                raise ValueError("The processed story is empty or invalid")
-            story_data = self._story_to_model(story, story_create.title, story_create.file_path, user_id)
+                if story.is_empty():
+                    raise ValueError("The processed story is empty or invalid")
+                story_data = self._story_to_model(story, story_create.title, story_create.file_path, user_id)
+                story_data["content_hash"] = content_hash
 
             # save in db
-            story_id = await self.story_repository.create_story(story_data, user_id)
+            if progress:
+                progress("saving", 0.95)
+            story_id = await self._insert_story(story_data, user_id)
 
             # get full story data after creation
             full_story = await self.story_repository.get_story_by_id(story_id)
@@ -104,17 +166,118 @@ class StoryService:
         except Exception as e:
             raise Exception(f"Failed to create story: {str(e)}")
 
+    async def stream_story_from_file(self, story_create: StoryCreate, user_id: str,
+                                     executor: Optional[Executor] = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """create a new story chapter by chapter, yielding (event, data) as each part is saved.
+        the processing keeps running and saving even if the caller stops listening"""
+        events: asyncio.Queue = asyncio.Queue()
+        task = asyncio.create_task(self._stream_and_save(story_create, user_id, executor, events.put_nowait))
+        _stream_tasks.add(task)
+        task.add_done_callback(_stream_tasks.discard)
+
+        while True:
+            event, data = await events.get()
+            yield event, data
+            if event in ("done", "error"):
+                return
+
+    async def _stream_and_save(self, story_create: StoryCreate, user_id: str, executor: Optional[Executor],
+                               emit: Callable[[Tuple[str, Dict[str, Any]]], None]):
+        """run the chapter generator off the event loop and save every chapter as it arrives"""
+        story_id = None
+        try:
+            loop = asyncio.get_running_loop()
+            content_hash = story_create.file_hash or await loop.run_in_executor(
+                executor, self._file_sha256, story_create.file_path
+            )
+
+            # the same PDF was already processed - reuse its analysis
+            analyzed_story = await self.story_repository.get_story_by_content_hash(content_hash)
+            if analyzed_story:
+                story_data = self._copy_analysis(
+                    analyzed_story, story_create.title, story_create.file_path, user_id, content_hash
+                )
+                story_id = await self._insert_story(story_data, user_id)
+                emit(("done", {"story_id": story_id, "reused": True}))
+                return
+
+            # a user is watching - the Gemini requests of this story go ahead of background jobs.
+            # the executor threads don't inherit the context, so the generator runs inside a copy of it
+            request_priority.set(INTERACTIVE)
+            context = contextvars.copy_context()
+
+            story = None
+            parts = self.story_processor.iter_story_from_file(story_create.file_path)
+            while (item := await loop.run_in_executor(executor, context.run, next, parts, None)) is not None:
+                kind, payload = item
+
+                if kind == "story":
+                    story = payload
+                    if story.is_empty():
+                        raise ValueError("The processed story is empty or invalid")
+
+                    story_data = self._story_to_model(story, story_create.title, story_create.file_path, user_id)
+                    story_data.update({"content_hash": content_hash, "status": "processing"})
+                    story_id = await self._insert_story(story_data, user_id)
+                    emit(("story", {"story_id": story_id, "chapters": story.chapters}))
+                else:
+                    index, entities, updated_entities, paragraphs = payload
+                    entity_models = [self._entity_to_model(entity).dict() for entity in entities]
+                    updated_models = {
+                        entity_index: self._entity_to_model(entity).dict()
+                        for entity_index, entity in updated_entities.items()
+                    }
+                    paragraph_models = [self._paragraph_to_model(paragraph).dict() for paragraph in paragraphs]
+                    await self.story_repository.append_chapter(
+                        story_id,
+                        [self._entity_to_document(entity) for entity in entities],
+                        paragraph_models,
+                        {entity_index: self._entity_to_document(entity)
+                         for entity_index, entity in updated_entities.items()}
+                    )
+
+                    chapter_start, chapter_end = story.chapters[index]
+                    emit(("chapter", {
+                        "index": index,
+                        "start": chapter_start,
+                        "end": chapter_end,
+                        "text": story.text_by_range(chapter_start, chapter_end),
+                        "entities": entity_models,
+                        "updated_entities": updated_models,
+                        "key_paragraphs": paragraph_models
+                    }))
+
+            await self.story_repository.set_story_status(story_id, "complete")
+            emit(("done", {"story_id": story_id}))
+
+        except Exception as e:
+            traceback.print_exc()
+            if story_id:
+                await self.story_repository.set_story_status(story_id, "failed")
+            emit(("error", {"detail": f"Failed to create story: {str(e)}"}))
+
+    async def story_exists(self, title: str, user_id: str) -> bool:
+        """check if the user already has a story with this title"""
+        existing_story = await self.story_repository.get_story_by_title_and_user(title, user_id)
+        return existing_story is not None
+
     async def get_story(self, story_id: str, user_id: str) -> Optional[Dict[str, Any]]:
         """get story by ID for a specific user"""
         story = await self.story_repository.get_story_by_id(story_id)
 
         if story and story.get("user_id") == user_id:
+            # positions are stored packed - decode them only for the full story
+            for entity in story.get("entities", []):
+                entity["coref_position"] = unpack_positions(entity.get("coref_position", []))
             return self._convert_objectid_to_string(story)
         return None
 
-    async def get_user_stories(self, user_id: str) -> List[StoryResponse]:
-        """get all stories for a specific user"""
-        stories = await self.story_repository.get_stories_by_user_id(user_id)
+    async def get_user_stories(self, user_id: str, after: Optional[str] = None,
+                               limit: int = 50) -> List[StoryResponse]:
+        """get a page of the stories of a specific user, after the story with ID `after`"""
+        if after and not ObjectId.is_valid(after):
+            raise ValueError("Invalid cursor")
+        stories = await self.story_repository.get_stories_by_user_id(user_id, after, limit)
 
         story_responses = []
         for story in stories:
@@ -124,8 +287,8 @@ class StoryService:
                 user_id=story["user_id"],
                 created_at=story["created_at"],
                 updated_at=story["updated_at"],
-                chapters_count=len(story.get("chapters", [])),
-                entities_count=len(story.get("entities", []))
+                chapters_count=story["chapters_count"],
+                entities_count=story["entities_count"]
             )
             story_responses.append(story_response)
 
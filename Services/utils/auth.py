@@ -1,12 +1,25 @@
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+import asyncio
 import os
+import time
 from FastAPIProject.config.config_loader import config
 
-# cryptography context for password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+_auth_config = config.get("auth", {})
+
+# cryptography context for password hashing - hashes with other rounds are upgraded on login
+BCRYPT_ROUNDS = _auth_config.get("bcrypt_rounds", 12)
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# bcrypt runs in its own threads, off the event loop; beyond HASH_MAX_PENDING calls new ones are rejected
+HASH_WORKERS = _auth_config.get("hash_workers", os.cpu_count() or 1)
+HASH_MAX_PENDING = _auth_config.get("hash_max_pending", HASH_WORKERS * 4)
+_hash_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+# created on first use, inside the running event loop
+_hash_slots: Optional[asyncio.Semaphore] = None
 
 # token settings
 SECRET_KEY = os.getenv("SECRET_KEY", config["jwt"]["secret_key"])
@@ -22,8 +35,34 @@ def get_password_hash(password):
     """Hash a password using bcrypt"""
     return pwd_context.hash(password)
 
+
+class PasswordHashingBusy(Exception):
+    """too many password hashes are already waiting - the request should be retried later"""
+
+
+async def _run_hashing(func, *args):
+    """run a bcrypt call in the hashing pool, or fail at once if the pool is backed up"""
+    global _hash_slots
+    if _hash_slots is None:
+        _hash_slots = asyncio.Semaphore(HASH_MAX_PENDING)
+    if _hash_slots.locked():
+        raise PasswordHashingBusy("Server is busy, please try again shortly")
+    async with _hash_slots:
+        return await asyncio.get_running_loop().run_in_executor(_hash_pool, func, *args)
+
+
+async def verify_and_update_password(plain_password, hashed_password) -> Tuple[bool, Optional[str]]:
+    """Verify a password without blocking the event loop.
+    :return (valid, new hash) - the new hash is set when the stored one uses outdated settings"""
+    return await _run_hashing(pwd_context.verify_and_update, plain_password, hashed_password)
+
+
+async def hash_password(password) -> str:
+    """Hash a password using bcrypt without blocking the event loop"""
+    return await _run_hashing(pwd_context.hash, password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    """Create a JWT access token with an expiration time"""
+    """Create a JWT access token with an expiration time and the time it was issued"""
     to_encode = data.copy()
 
     if expires_delta:
@@ -31,7 +70,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
 
-    to_encode.update({"exp": expire})
+    # fractional seconds, so a token issued right after a revocation is not caught by it
+    to_encode.update({"exp": expire, "iat": time.time()})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
     return encoded_jwt
\ No newline at end of file
@@ -1,7 +1,6 @@
 import json
-from FastAPIProject.config.config_loader import config
 from FastAPIProject.Models.domain.entity import Entity
-from google import genai
+from FastAPIProject.Services.utils.gemini_gateway import gemini_gateway
 
 
 def api_to_gemini(passage: str, characters: list[Entity]) -> dict[str, dict[str, str]]:
@@ -27,14 +26,7 @@ def api_to_gemini(passage: str, characters: list[Entity]) -> dict[str, dict[str,
     """
 
     try:
-        client = genai.Client(api_key=config["services"]["google_gemini"]["api_key"])
-
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=[prompt]
-        )
-
-        text = response.candidates[0].content.parts[0].text.strip()
+        text = gemini_gateway.generate_sync(prompt, "gemini-2.0-flash")
         if not text:
             print("Gemini returned empty response")
             return {}
@@ -0,0 +1,83 @@
+from typing import Dict, List, Optional, Set, Tuple
+
+from FastAPIProject.Models.domain.entity import Entity
+
+# mentions that say nothing about who is meant - never used to join clusters
+PRONOUNS = frozenset({
+    "i", "me", "my", "mine", "myself", "you", "your", "yours", "yourself", "yourselves",
+    "he", "him", "his", "himself", "she", "her", "hers", "herself", "it", "its", "itself",
+    "we", "us", "our", "ours", "ourselves", "they", "them", "their", "theirs", "themselves",
+    "this", "that", "these", "those", "who", "whom", "whose", "which", "one",
+})
+HONORIFICS = ("mr. ", "mrs. ", "ms. ", "dr. ", "mr ", "mrs ", "ms ", "dr ", "miss ", "sir ", "lady ", "lord ")
+
+
+def normalize_name(mention: str) -> str:
+    """casefold a mention and drop surrounding punctuation, a possessive 's, a leading article and an honorific"""
+    name = " ".join(mention.casefold().split()).strip(".,;:!?\"'()[]“”‘’-")
+    for suffix in ("'s", "’s"):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    for article in ("the ", "a ", "an "):
+        if name.startswith(article):
+            name = name[len(article):]
+    for honorific in HONORIFICS:
+        if name.startswith(honorific):
+            name = name[len(honorific):]
+            break
+    return name
+
+
+def name_keys(entity: Entity) -> Set[str]:
+    """normalized names and nicknames of an entity that can identify it"""
+    keys = {normalize_name(mention) for mention in [entity.name, *entity.nicknames]}
+    return {key for key in keys if key not in PRONOUNS and any(c.isalpha() for c in key)}
+
+
+class EntityConsolidator:
+    """merges the coreference clusters of each chapter into story-level entities.
+    a cluster joins the first entity with the same label that shares a normalized name or nickname;
+    its mentions are appended to the entity and entity.chapters records the range of each chapter"""
+
+    def __init__(self, entities: Optional[List[Entity]] = None):
+        self.entities = entities if entities is not None else []
+        # (label, normalized name) -> index of the entity
+        self._by_key: Dict[Tuple[str, str], int] = {}
+        for index, entity in enumerate(self.entities):
+            self._index(index, entity)
+
+    def _index(self, index: int, entity: Entity):
+        for key in name_keys(entity):
+            self._by_key.setdefault((entity.label, key), index)
+
+    def add_chapter(self, chapter: int, clusters: List[Entity]) -> List[int]:
+        """merge the clusters of a chapter into the story entities
+        :return indices of the entities mentioned in the chapter"""
+        mentioned = []
+        for cluster in clusters:
+            keys = name_keys(cluster)
+            matches = [self._by_key[(cluster.label, key)] for key in keys if (cluster.label, key) in self._by_key]
+
+            if matches:
+                index = min(matches)
+                self._merge(self.entities[index], cluster, chapter)
+            else:
+                index = len(self.entities)
+                cluster.chapters = [(chapter, 0, len(cluster.coref_position))]
+                self.entities.append(cluster)
+
+            self._index(index, self.entities[index])
+            if index not in mentioned:
+                mentioned.append(index)
+        return mentioned
+
+    @staticmethod
+    def _merge(entity: Entity, cluster: Entity, chapter: int):
+        """append the mentions of a cluster to an entity (the nicknames stay aligned with the positions)"""
+        first = len(entity.coref_position)
+        entity.nicknames.extend([cluster.name, *cluster.nicknames])
+        entity.coref_position.extend(cluster.coref_position)
+
+        if entity.chapters and entity.chapters[-1][0] == chapter:
+            first = entity.chapters.pop()[1]
+        entity.chapters.append((chapter, first, len(entity.coref_position)))
@@ -0,0 +1,124 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from typing import Any, Awaitable, List, Optional, Sequence, Union
+
+from google import genai
+
+from FastAPIProject.config.config_loader import config
+from FastAPIProject.Services.utils.rate_limiter import RateLimiter, request_priority
+
+
+class GeminiQuotaExceeded(Exception):
+    """the daily request quota is used up"""
+
+
+class GeminiGateway:
+    """every Gemini request goes through here: one client, used through its async API on a
+    background event loop, with up to `max_concurrency` requests in flight within the rate limits.
+    sync code (the story processing threads) calls generate_sync / generate_many_sync.
+    requests are prioritized by `request_priority` of the caller's context"""
+
+    def __init__(self, api_key: str, max_concurrency: int, limiter: RateLimiter):
+        self.api_key = api_key
+        self.max_concurrency = max_concurrency
+        self.limiter = limiter
+        self._client: Optional[genai.Client] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        # after a 429 no request is sent until then (monotonic time)
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """the gateway's event loop, started in a daemon thread on first use"""
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="gemini-gateway", daemon=True).start()
+                self._client = genai.Client(api_key=self.api_key)
+                self._loop = loop
+            return self._loop
+
+    def _run(self, coroutine: Awaitable[Any]) -> Any:
+        """run a coroutine on the gateway loop and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._get_loop()).result()
+
+    async def generate(self, prompt: str, model: str, estimated_tokens: int = 1000,
+                       priority: Optional[str] = None) -> str:
+        """send one prompt and return the text of the answer - can be awaited from any event loop"""
+        priority = priority or request_priority.get()
+        loop = self._get_loop()
+        if asyncio.get_running_loop() is not loop:
+            return await asyncio.wrap_future(
+                asyncio.run_coroutine_threadsafe(self.generate(prompt, model, estimated_tokens, priority), loop)
+            )
+
+        # wait for the quota before taking a slot, so waiting batch requests don't hold back interactive ones
+        await self._wait_for_quota(estimated_tokens, priority)
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        async with self._slots:
+            try:
+                response = await self._client.aio.models.generate_content(model=model, contents=[prompt])
+            except Exception as e:
+                if "429" in str(e) or "quota" in str(e).lower():
+                    self._pause(str(e))
+                raise
+        return response.candidates[0].content.parts[0].text.strip()
+
+    async def _wait_for_quota(self, estimated_tokens: int, priority: str):
+        """wait out a 429 pause, then until the request fits in the rate limits (taken right away)"""
+        while (pause := self._paused_until - time.monotonic()) > 0:
+            await asyncio.sleep(pause)
+
+        if not await self.limiter.acquire(estimated_tokens, priority):
+            raise GeminiQuotaExceeded("Daily quota exceeded. Please try again tomorrow.")
+
+    def _pause(self, error: str):
+        """hold back every request for the delay the API asked for (or a minute)"""
+        delay_match = re.search(r"'retryDelay': '(\d+)s'", error)
+        delay = int(delay_match.group(1)) + 2 if delay_match else 60
+        print(f"Quota exceeded - pausing Gemini requests for {delay} seconds")
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+    def generate_sync(self, prompt: str, model: str, estimated_tokens: int = 1000) -> str:
+        """generate() for sync callers"""
+        return self._run(self.generate(prompt, model, estimated_tokens, request_priority.get()))
+
+    async def generate_many(self, prompts: Sequence[str], model: str, estimated_tokens: Sequence[int],
+                            priority: Optional[str] = None) -> List[Union[str, Exception]]:
+        """send the prompts concurrently - :return the answer of each prompt, or the exception it failed with"""
+        priority = priority or request_priority.get()
+        return await asyncio.gather(
+            *(self.generate(prompt, model, tokens, priority) for prompt, tokens in zip(prompts, estimated_tokens)),
+            return_exceptions=True
+        )
+
+    def generate_many_sync(self, prompts: Sequence[str], model: str,
+                           estimated_tokens: Sequence[int]) -> List[Union[str, Exception]]:
+        """generate_many() for sync callers"""
+        return self._run(self.generate_many(prompts, model, estimated_tokens, request_priority.get()))
+
+
+_gemini_config = config["services"]["google_gemini"]
+
+# Global Gemini rate limiter instance - free tier limits (conservative: the actual limits are 15, 32000 and 1500)
+gemini_rate_limiter = RateLimiter(
+    _gemini_config.get("rate_limit_path", os.path.join(config["uploads"]["directory"], ".gemini_rate_limit.sqlite")),
+    "gemini",
+    _gemini_config.get("requests_per_minute", 10),
+    _gemini_config.get("tokens_per_minute", 25000),
+    _gemini_config.get("requests_per_day", 1200),
+    # the daily quota resets at midnight Pacific time
+    _gemini_config.get("quota_timezone", "America/Los_Angeles")
+)
+
+# Global Gemini gateway instance
+gemini_gateway = GeminiGateway(
+    _gemini_config["api_key"],
+    _gemini_config.get("max_concurrency", 4),
+    gemini_rate_limiter
+)
@@ -0,0 +1,170 @@
+"""Shared model-inference process.
+
+One process loads the NER and coreference models and serves them over local IPC (a Unix socket path, or a
+\\\\.\\pipe\\name named pipe on Windows), so every uvicorn worker uses the same copy of the models.
+
+start it with: python -m FastAPIProject.Services.utils.inference
+and set services.inference.socket in the config to the same address for the API workers.
+the server and the workers share a secret key - services.inference.authkey, or the INFERENCE_AUTHKEY
+environment variable. a Unix socket is created in a directory only its owner can access
+(by default ~/.comics-inference).
+"""
+import os
+import stat
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from FastAPIProject.config.config_loader import config
+
+_inference_config = config["services"].get("inference", {})
+INFERENCE_ADDRESS: Optional[str] = _inference_config.get("socket")
+_authkey = os.getenv("INFERENCE_AUTHKEY", _inference_config.get("authkey"))
+INFERENCE_AUTHKEY: Optional[bytes] = _authkey.encode() if _authkey else None
+DEFAULT_INFERENCE_ADDRESS = os.path.join(os.path.expanduser("~"), ".comics-inference", "inference.sock")
+
+
+def _require_authkey(authkey: Optional[bytes]) -> bytes:
+    """the connections unpickle what they receive - never run them without a secret key"""
+    if not authkey:
+        raise ValueError("No inference authkey - set services.inference.authkey or INFERENCE_AUTHKEY")
+    return authkey
+
+
+def _prepare_socket_directory(address: str):
+    """create the directory of a Unix socket with 0700 permissions, and refuse one others can write to"""
+    directory = os.path.dirname(os.path.abspath(address))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    mode = os.stat(directory).st_mode
+    if mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f"Inference socket directory {directory} is writable by other users - "
+                              f"use a private directory (mode 0700)")
+
+
+class InferenceClient:
+    """thin client of the inference process - one connection per calling thread"""
+
+    def __init__(self, address: str, authkey: bytes):
+        self.address = address
+        self.authkey = _require_authkey(authkey)
+        self._local = threading.local()
+        self._health_lock = threading.Lock()
+        # (monotonic time, answered, error) of the last health check
+        self._health: Tuple[float, bool, Optional[str]] = (float("-inf"), False, None)
+
+    def _connection(self):
+        if getattr(self._local, "conn", None) is None:
+            self._local.conn = Client(self.address, authkey=self.authkey)
+        return self._local.conn
+
+    def _reset(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+        self._local.conn = None
+
+    def call(self, method: str, *args) -> Any:
+        """call a method of the inference process and return its result"""
+        for attempt in range(2):
+            try:
+                conn = self._connection()
+                conn.send((method, args))
+                status, result = conn.recv()
+                break
+            except (EOFError, OSError):
+                # the server restarted - reconnect once
+                self._reset()
+                if attempt == 1:
+                    raise
+
+        if status == "error":
+            raise RuntimeError(f"Inference server error in {method}: {result}")
+        return result
+
+    def check(self, max_age: float = 5.0, timeout: float = 2.0) -> Tuple[bool, Optional[str]]:
+        """ping the inference process on a connection of its own, at most once per `max_age` seconds
+        (blocking - call it off the event loop). :return if it answered within `timeout`, and the error if not"""
+        with self._health_lock:
+            checked_at, up, error = self._health
+            if time.monotonic() - checked_at >= max_age:
+                try:
+                    with Client(self.address, authkey=self.authkey) as conn:
+                        conn.send(("ping", ()))
+                        if not conn.poll(timeout):
+                            raise TimeoutError(f"no answer within {timeout}s")
+                        conn.recv()
+                    up, error = True, None
+                except Exception as e:
+                    up, error = False, f"{type(e).__name__}: {e}"
+                self._health = (time.monotonic(), up, error)
+            return up, error
+
+
+class InferenceServer:
+    """serves model calls to the API workers, one thread per connection"""
+
+    def __init__(self, address: str, authkey: bytes, handlers: Dict[str, Callable[..., Any]]):
+        self.address = address
+        self.authkey = _require_authkey(authkey)
+        self.handlers = handlers
+        # models are not thread-safe - one call per method at a time
+        self._locks = {name: threading.Lock() for name in handlers}
+        self._is_pipe = address.startswith("\\\\")
+        if not self._is_pipe:
+            _prepare_socket_directory(address)
+
+    def serve_forever(self):
+        if not self._is_pipe and os.path.exists(self.address):
+            os.remove(self.address)
+
+        with Listener(self.address, authkey=self.authkey) as listener:
+            if not self._is_pipe:
+                os.chmod(self.address, 0o600)
+            print(f"Inference server listening on {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    print(f"Rejected inference connection: {e}")
+                    continue
+                threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        with conn:
+            while True:
+                try:
+                    method, args = conn.recv()
+                except (EOFError, OSError):
+                    return
+
+                try:
+                    with self._locks[method]:
+                        result = self.handlers[method](*args)
+                    conn.send(("ok", result))
+                except Exception as e:
+                    conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+# Global client instance - None when the models run inside this process
+inference_client: Optional[InferenceClient] = (
+    InferenceClient(INFERENCE_ADDRESS, INFERENCE_AUTHKEY) if INFERENCE_ADDRESS else None
+)
+
+
+def main():
+    from FastAPIProject.Services.utils import ner
+    from FastAPIProject.Services.utils.model_registry import models
+
+    # check the key and the socket directory before spending minutes on loading the models
+    server = InferenceServer(INFERENCE_ADDRESS or DEFAULT_INFERENCE_ADDRESS, INFERENCE_AUTHKEY, {
+        "ping": lambda: "pong",
+        "ner_batch": ner.ner_batch_local,
+        "coreference_resolution": ner.coreference_resolution_local,
+    })
+    models.warmup(["spacy", "maverick"])
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+
+class ModelRegistry:
+    """loads models on first use (or in an explicit warmup) and records how long each one took"""
+
+    def __init__(self):
+        self._loaders: Dict[str, Callable[[], Any]] = {}
+        self._models: Dict[str, Any] = {}
+        self._load_seconds: Dict[str, float] = {}
+        self._errors: Dict[str, str] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        # models are not thread-safe - one caller per model at a time
+        self._use_locks: Dict[str, threading.Lock] = {}
+        self._required: Dict[str, bool] = {}
+
+    def register(self, name: str, loader: Callable[[], Any], required: bool = True):
+        """register a loader that is called once, the first time the model is needed.
+        only required models are loaded by warmup() and needed for readiness"""
+        self._loaders[name] = loader
+        self._required[name] = required
+        self._locks.setdefault(name, threading.Lock())
+        self._use_locks.setdefault(name, threading.Lock())
+
+    def get(self, name: str) -> Any:
+        """:return the loaded model, loading it first if needed"""
+        if name in self._models:
+            return self._models[name]
+
+        with self._locks[name]:
+            # another thread may have loaded it while we waited
+            if name not in self._models:
+                start = time.perf_counter()
+                try:
+                    self._models[name] = self._loaders[name]()
+                except Exception as e:
+                    self._errors[name] = str(e)
+                    raise
+                self._load_seconds[name] = time.perf_counter() - start
+                self._errors.pop(name, None)
+                print(f"Loaded model '{name}' in {self._load_seconds[name]:.1f}s")
+        return self._models[name]
+
+    @contextmanager
+    def using(self, name: str) -> Iterator[Any]:
+        """the loaded model, held for the caller alone until the block ends - concurrent pipelines
+        take turns, so they neither share a model's state nor hold its activations in memory at once"""
+        model = self.get(name)
+        with self._use_locks[name]:
+            yield model
+
+    def warmup(self, names: Optional[Iterable[str]] = None) -> Dict[str, float]:
+        """load the given models (all required models by default) and return their load times"""
+        for name in names or [name for name in self._loaders if self._required[name]]:
+            try:
+                self.get(name)
+            except Exception as e:
+                print(f"Failed to load model '{name}': {e}")
+        return dict(self._load_seconds)
+
+    def is_ready(self) -> bool:
+        """check if every required model is loaded"""
+        return all(name in self._models for name in self._loaders if self._required[name])
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """load state, time and last error of every required model"""
+        return {
+            name: {
+                "loaded": name in self._models,
+                "seconds": self._load_seconds.get(name),
+                "error": self._errors.get(name),
+            }
+            for name in self._loaders if self._required[name]
+        }
+
+
+# Global model registry instance
+models = ModelRegistry()
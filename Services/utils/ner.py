@@ -4,72 +4,92 @@ from typing import List
 
 from FastAPIProject.config.config_loader import config
 
-from textranker import Interval, IntervalTree
 from collections import Counter
-from FastAPIProject.Services.maverick_coref.maverick import Maverick
-from torch import cuda
 
-import spacy
 from FastAPIProject.Models.domain.entity import Entity
-from FastAPIProject.Services.utils.pegasus_xsum import api_to_gemini
+from FastAPIProject.Models.domain.entity_registry import EntityRegistry
+from FastAPIProject.Services.utils.pegasus_xsum import api_to_gemini, DESCRIPTION_PROMPT_VERSION
 # from FastAPIProject.Services.utils.description_extraction import api_to_gemini
 from FastAPIProject.Services.utils.gender import is_male
+from FastAPIProject.Services.utils.windows import split_windows, owned_ranges, merge_window_clusters
+from FastAPIProject.Services.utils.span_alignment import align_spans
+from FastAPIProject.Services.utils.entity_consolidation import EntityConsolidator
+from FastAPIProject.Services.utils.model_registry import models
+from FastAPIProject.Services.utils.inference import inference_client
+from FastAPIProject.Services.utils.stage_cache import stage_cache
 
+# components ner() needs - the rest (tagger, parser, lemmatizer...) are skipped for NER
+NER_PIPES = ("transformer", "tok2vec", "ner")
+NER_BATCH_SIZE = config["services"]["ner"].get("batch_size", 8)
+NER_PROCESSES = config["services"]["ner"].get("n_process", 1)
 
-# nlp = spacy.load("en_core_web_sm")
-nlp = spacy.load("en_core_web_trf")
+# long chapters are processed in overlapping windows to bound memory
+NER_WINDOW = config["services"]["ner"].get("window_chars", 100000)
+NER_OVERLAP = config["services"]["ner"].get("overlap_chars", 2000)
+COREF_WINDOW = config["services"]["maverick_coref"].get("window_chars", 20000)
+COREF_OVERLAP = config["services"]["maverick_coref"].get("overlap_chars", 2000)
 
-sys.path.append(config["services"]["maverick_coref"]["path"])
+# cached results are reused only for the same model and windowing
+SPACY_MODEL = "en_core_web_trf"
+NER_VERSION = f"{SPACY_MODEL}|{NER_WINDOW}|{NER_OVERLAP}"
+COREF_VERSION = f"{config['services']['maverick_coref']['weights']}|{COREF_WINDOW}|{COREF_OVERLAP}"
 
-coref_model = Maverick(
-    hf_name_or_path=config["services"]["maverick_coref"]["weights"],
-    device="cpu" if not cuda.is_available() else "cuda:0"
-)
 
 
-def entity_extraction(chapters: list[str]) -> list[Entity]:
-    all_entities = []
+def _load_spacy():
+    """load the spaCy pipeline (on first use)"""
+    import spacy
+    # return spacy.load("en_core_web_sm")
+    return spacy.load(SPACY_MODEL)
 
-    for chapter in chapters:
-        c_entities = []
-        ners = ner(chapter)
-        # print(ners)
-        corefs = coreference_resolution(chapter)
 
-        # map the loction -> (text, label)
-        ner_positions = {(start, end): (text, label) for text, label, start, end in ners}
+def _load_maverick():
+    """load the Maverick coreference model (on first use)"""
+    sys.path.append(config["services"]["maverick_coref"]["path"])
+    from torch import cuda
+    from transformers import DebertaV2Model
+    from FastAPIProject.Services.maverick_coref.maverick import Maverick
 
-        # build the interval tree for NER positions
-        ner_tree = IntervalTree()
-        for text, label, start, end in ners:
-            interval = Interval(start, end)
-            ner_tree.insert(interval)
+    # Patch for DebertaV2Model - fix hidden_size property
+    DebertaV2Model.hidden_size = property(lambda self: self.config.hidden_size)
 
-        # map cluster id -> list of coreference -label
-        clusters = {}
+    return Maverick(
+        hf_name_or_path=config["services"]["maverick_coref"]["weights"],
+        device="cpu" if not cuda.is_available() else "cuda:0"
+    )
 
-        for cluster_id, (mentions_texts, mentions_offsets) in enumerate(corefs):
-            cluster_mentions = []
-            labels = []
 
-            for text, (start_char, end_char) in zip(mentions_texts, mentions_offsets):
-                cluster_mentions.append(text)
-                interval = Interval(start_char, end_char)
-                # search in tree - return dict or None
+# with an inference server the models are loaded there, and /ready checks that it answers
+models.register("spacy", _load_spacy, required=inference_client is None)
+models.register("maverick", _load_maverick, required=inference_client is None)
 
-                overlap_result = ner_tree.overlapSearch(interval)
 
-                if overlap_result is None:
-                    continue
+def entity_extraction(chapters: list[str], consolidator: EntityConsolidator = None,
+                      first_chapter: int = 0) -> list[Entity]:
+    """Extract the entities of the chapters and merge them into story-level entities.
+    pass a consolidator to continue from the entities of earlier chapters (chapters are numbered from first_chapter)"""
+    consolidator = consolidator if consolidator is not None else EntityConsolidator()
+    chapters_ners = ner_batch(chapters)
+    mentioned = set()
+
+    for chapter_index, (chapter, ners) in enumerate(zip(chapters, chapters_ners), start=first_chapter):
+        c_entities = []
+        # print(ners)
+        corefs = coreference_resolution(chapter)
+
+        # align all coreference mentions of the chapter with the NER spans at once
+        mention_spans = [tuple(span) for _, offsets in corefs for span in offsets]
+        mention_clusters = [cluster_id for cluster_id, (_, offsets) in enumerate(corefs) for _ in offsets]
+        mention_idx, ner_idx = align_spans(mention_spans, [(start, end) for _, _, start, end in ners])
 
-                # extract the label from the first overlap
-                overlap_interval = overlap_result['interval']
-                overlap_start = overlap_interval.low
-                overlap_end = overlap_interval.high
+        # map cluster id -> labels of every NER span its mentions overlap
+        clusters_labels = [[] for _ in corefs]
+        for mention, ner_index in zip(mention_idx.tolist(), ner_idx.tolist()):
+            clusters_labels[mention_clusters[mention]].append(ners[ner_index][1])
 
-                if (overlap_start, overlap_end) in ner_positions:
-                    ner_text, ner_label = ner_positions[(overlap_start, overlap_end)]
-                    labels.append(ner_label)
+        for cluster_id, (mentions_texts, mentions_offsets) in enumerate(corefs):
+            cluster_mentions = list(mentions_texts)
+            labels = clusters_labels[cluster_id]
 
             print(labels)
             label = Counter(labels).most_common(1)[0][0] if labels else "UNKNOWN"
@@ -80,12 +100,17 @@ def entity_extraction(chapters: list[str]) -> list[Entity]:
             entity = Entity(name, label, nicknames, coref_positions)
             c_entities.append(entity)
 
-        # description extraction
-        descriptions = description_extraction(chapter, c_entities)
+        chapter_entities = [consolidator.entities[i] for i in consolidator.add_chapter(chapter_index, c_entities)]
+        mentioned.update(id(entity) for entity in chapter_entities)
+
+        # description extraction - only for entities that were not described in an earlier chapter
+        to_describe = [entity for entity in chapter_entities if not has_description(entity)]
+        descriptions = description_extraction(chapter, to_describe) if to_describe else {}
         print(descriptions)
 
+        described = EntityRegistry(to_describe)
         for ent, description in descriptions.items():
-            c = get_ent_by_nickname(ent, c_entities)
+            c = get_ent_by_nickname(ent, described)
             if c is not None:
                 # if description id python dict, assign it directly
                 if isinstance(description, dict):
@@ -98,50 +123,125 @@ def entity_extraction(chapters: list[str]) -> list[Entity]:
                         print(f"Warning: Could not parse description for {ent}: {e}")
                         c.description = {}
 
-        all_entities.extend(c_entities)
-
-        del ner_tree
-
     # add gender to entities description
-    for entity in all_entities:
-        if entity.label == "PERSON":
+    registry = EntityRegistry(consolidator.entities)
+    for index in registry.with_label("PERSON"):
+        entity = registry.get(index)
+        if id(entity) in mentioned:
             ismale = is_male(entity)
             if isinstance(entity.description, dict):
                 entity.description["gender"] = "male" if ismale else "female"
             else:
                 # If description is still not a dict, initialize it properly
                 entity.description = {"gender": "male" if ismale else "female"}
-    return all_entities
+    return consolidator.entities
+
+
+def has_description(entity: Entity) -> bool:
+    """check if the entity already has a description (other than its gender)"""
+    return isinstance(entity.description, dict) and any(key != "gender" for key in entity.description)
 
 
 def ner(chapter):
     """Extract named entities from a chapter using spaCy"""
-    doc = nlp(chapter)
-    entities = [(ent.text, ent.label_, ent.start_char, ent.end_char) for ent in doc.ents]
-    return entities
+    return ner_batch([chapter])[0]
+
+def ner_batch(chapters: list[str]) -> list[list[tuple[str, str, int, int]]]:
+    """Extract named entities from all chapters that are not cached yet,
+    in the inference server when one is configured"""
+    chapters_entities = [stage_cache.get("ner", NER_VERSION, chapter) for chapter in chapters]
+    missing = [i for i, entities in enumerate(chapters_entities) if entities is None]
+    if not missing:
+        return chapters_entities
+
+    texts = [chapters[i] for i in missing]
+    if inference_client is not None:
+        new_entities = inference_client.call("ner_batch", texts)
+    else:
+        new_entities = ner_batch_local(texts)
+
+    for i, entities in zip(missing, new_entities):
+        stage_cache.set("ner", NER_VERSION, chapters[i], entities)
+        chapters_entities[i] = entities
+    return chapters_entities
+
+def ner_batch_local(chapters: list[str]) -> list[list[tuple[str, str, int, int]]]:
+    """Extract named entities from all chapters in batches, running only the components NER needs.
+    Long chapters are split into overlapping windows; each entity is kept by the window that owns its start"""
+    chapters_windows = [split_windows(chapter, NER_WINDOW, NER_OVERLAP) for chapter in chapters]
+    texts = [chapter[start:end] for chapter, windows in zip(chapters, chapters_windows) for start, end in windows]
+
+    with models.using("spacy") as nlp:
+        disabled = [name for name in nlp.pipe_names if name not in NER_PIPES]
+        docs = iter(nlp.pipe(texts, batch_size=NER_BATCH_SIZE, n_process=NER_PROCESSES, disable=disabled))
+
+        # the docs are made lazily - read them all while holding the model
+        chapters_entities = []
+        for windows in chapters_windows:
+            entities = []
+            for (start, _), (own_start, own_end) in zip(windows, owned_ranges(windows)):
+                for ent in next(docs).ents:
+                    if own_start <= start + ent.start_char < own_end:
+                        entities.append((ent.text, ent.label_, start + ent.start_char, start + ent.end_char))
+            chapters_entities.append(entities)
+    return chapters_entities
 
 def coreference_resolution(chapter: str):
-    """Resolve coreferences in a chapter using Maverick"""
-    result = coref_model.predict(chapter)
+    """Resolve coreferences in a chapter (unless cached), in the inference server when one is configured"""
+    clusters = stage_cache.get("coref", COREF_VERSION, chapter)
+    if clusters is not None:
+        return clusters
+
+    if inference_client is not None:
+        clusters = inference_client.call("coreference_resolution", chapter)
+    else:
+        clusters = coreference_resolution_local(chapter)
+    stage_cache.set("coref", COREF_VERSION, chapter, clusters)
+    return clusters
+
+def coreference_resolution_local(chapter: str):
+    """Resolve coreferences in a chapter using Maverick.
+    Long chapters are resolved in overlapping windows whose clusters are joined on shared mentions"""
+    windows = split_windows(chapter, COREF_WINDOW, COREF_OVERLAP)
+    if len(windows) == 1:
+        return _coreference_window(chapter, 0)
+
+    window_clusters = [_coreference_window(chapter[start:end], start) for start, end in windows]
+    return merge_window_clusters(window_clusters)
+
+def _coreference_window(text: str, offset: int):
+    """Run Maverick on one window and shift the mention offsets by the window start"""
+    with models.using("maverick") as maverick:
+        result = maverick.predict(text)
     print(result["clusters_char_offsets"])
     offsets = []
     for i in range(len(result["clusters_char_offsets"])):
         offsets.append([])
         for s, e in result["clusters_char_offsets"][i]:
-            offsets[i].append((s, e + 1))
+            offsets[i].append((offset + int(s), offset + int(e) + 1))
 
-    chapter_chars = zip(result["clusters_token_text"], offsets)
+    chapter_chars = list(zip(result["clusters_token_text"], offsets))
     return chapter_chars
 
 def description_extraction(chapter: str, characters: list[Entity]):
     """Extract character descriptions from a chapter using Google Gemini API"""
+    # the prompt depends on the chapter and on the character names
+    key = json.dumps([chapter, [char.name for char in characters]])
+    descriptions = stage_cache.get("description", DESCRIPTION_PROMPT_VERSION, key)
+    if descriptions is not None:
+        return descriptions
+
     descriptions = api_to_gemini(chapter, characters)
+    # an empty result means the request failed (or found nothing) - try again next time
+    if descriptions:
+        stage_cache.set("description", DESCRIPTION_PROMPT_VERSION, key, descriptions)
     return descriptions
 
 # TODO:  להתאים שיהיה עבור כל הטקסט כך שישלח לטקסטרנק ושם יבדקו הטווחים
 def count_verbs_in_paragraph(paragraph: str) -> dict:
     """Count different types of verbs in a paragraph"""
-    doc = nlp(paragraph)
+    with models.using("spacy") as nlp:
+        doc = nlp(paragraph)
 
     verb_counts = {
         'total_verbs': 0,
@@ -172,20 +272,17 @@ def count_verbs_in_paragraph(paragraph: str) -> dict:
     return verb_counts
 
 
-def get_ent_by_nickname(nickname: str, entities: list[Entity]) -> Entity:
-    """Get an entity by its nickname from a list of entities"""
-    for entity in entities:
-        for nName in entity.nicknames:
-            if nName == nickname:
-                return entity
-    return None
+def get_ent_by_nickname(nickname: str, entities: EntityRegistry) -> Entity:
+    """Get an entity by its name or nickname"""
+    return entities.by_name(nickname)
 
-def get_place_and_time(entities: Entity) -> (List[int],List[int]):
-    """Find place and time in a paragraph using spaCy"""
+def get_place_and_time(entities: List[int], registry: EntityRegistry) -> (List[int],List[int]):
+    """Find place and time in a paragraph - as positions in its list of known entities"""
     place = []
     time = []
 
-    for index, ent in enumerate(entities):
+    known = [registry.get(e) for e in entities if registry.get(e) is not None]
+    for index, ent in enumerate(known):
         if ent.label in config["services"]["ner"]["place"]:
             place.append(index)
         elif ent.label in config["services"]["ner"]["time"]:
@@ -0,0 +1,65 @@
+import hashlib
+import json
+import os
+import uuid
+from pathlib import Path
+from typing import Optional
+
+
+class OcrCache:
+    """on-disk cache of OCR results keyed by the hash of the rendered page, with LRU eviction by size"""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(image: bytes, dpi: int) -> str:
+        """cache key of a rendered page"""
+        return hashlib.sha256(image + f":{dpi}".encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key: str) -> Optional[dict]:
+        """:return the cached OCR data, or None on a miss"""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            # mark as recently used
+            os.utime(path)
+            return data
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def put(self, key: str, data: dict):
+        """store OCR data (written atomically, so concurrent workers never see partial files)"""
+        tmp_path = self.directory / f"{key}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"Failed to write OCR cache entry: {e}")
+            tmp_path.unlink(missing_ok=True)
+
+    def evict(self):
+        """remove the least recently used entries until the cache fits its size limit"""
+        entries = []
+        total = 0
+        for path in self.directory.glob("*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
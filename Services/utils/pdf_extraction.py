@@ -0,0 +1,133 @@
+import io
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+import pytesseract
+from PIL import Image
+
+from FastAPIProject.config.config_loader import config
+from FastAPIProject.Services.utils.ocr_cache import OcrCache
+
+# raw content of one page: ("blocks", blocks), ("ocr", tesseract data) or ("error", message).
+# pages that need OCR are first read as ("ocr", None) and filled in by run_pending_ocr
+PageContent = Tuple[str, Any]
+
+_pdf_config = config["services"].get("pdf", {})
+PARALLEL_MIN_PAGES = _pdf_config.get("parallel_min_pages", 32)
+EXTRACTION_WORKERS = _pdf_config.get("workers") or os.cpu_count() or 1
+
+_ocr_config = config["services"].get("ocr", {})
+OCR_WORKERS = _ocr_config.get("workers") or os.cpu_count() or 1
+OCR_DPI = _ocr_config.get("dpi", 72)
+OCR_FIELDS = ("level", "left", "top", "width", "height", "text", "block_num")
+
+ocr_cache = OcrCache(
+    _ocr_config.get("cache_dir", os.path.join(config["uploads"]["directory"], ".ocr_cache")),
+    _ocr_config.get("cache_max_mb", 512) * 1024 * 1024
+)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_ocr_pool: Optional[ProcessPoolExecutor] = None
+
+
+def read_page_content(page) -> PageContent:
+    """read the text blocks of a page, marking it for OCR when it has none"""
+    try:
+        blocks = page.get_text("blocks")
+        if not blocks:
+            return "ocr", None
+        return "blocks", blocks
+    except Exception as e:
+        return "error", str(e)
+
+
+def ocr_page(pdf_path: str, page_number: int, dpi: int) -> dict:
+    """render a page and return its Tesseract word boxes in PDF points - runs in a worker process"""
+    doc = fitz.open(pdf_path)
+    try:
+        image = doc[page_number].get_pixmap(dpi=dpi).tobytes()
+    finally:
+        doc.close()
+
+    key = OcrCache.key(image, dpi)
+    data = ocr_cache.get(key)
+    if data is not None:
+        return data
+
+    img = Image.open(io.BytesIO(image))
+    raw = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT)
+    img.close()
+
+    data = {field: raw[field] for field in OCR_FIELDS}
+    # scale pixel boxes back to PDF points, so paragraph detection does not depend on the DPI
+    if dpi != 72:
+        scale = 72 / dpi
+        for field in ("left", "top", "width", "height"):
+            data[field] = [round(v * scale) for v in data[field]]
+
+    ocr_cache.put(key, data)
+    return data
+
+
+def extract_page_range(pdf_path: str, start: int, end: int) -> List[PageContent]:
+    """read the content of pages [start, end) - runs in a worker process"""
+    doc = fitz.open(pdf_path)
+    try:
+        return [read_page_content(doc[i]) for i in range(start, end)]
+    finally:
+        doc.close()
+
+
+def page_ranges(page_count: int, workers: int) -> List[Tuple[int, int]]:
+    """split the pages into contiguous ranges, a few per worker so slow ranges are balanced"""
+    size = max(1, math.ceil(page_count / (workers * 4)))
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """create the extraction pool on first use"""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS)
+    return _pool
+
+
+def _get_ocr_pool() -> ProcessPoolExecutor:
+    """create the OCR pool on first use"""
+    global _ocr_pool
+    if _ocr_pool is None:
+        _ocr_pool = ProcessPoolExecutor(max_workers=OCR_WORKERS)
+    return _ocr_pool
+
+
+def run_pending_ocr(pdf_path: str, contents: List[PageContent]) -> List[PageContent]:
+    """OCR every page marked ("ocr", None) in the OCR pool, using the on-disk cache"""
+    pending = [i for i, (kind, payload) in enumerate(contents) if kind == "ocr" and payload is None]
+    if not pending:
+        return contents
+
+    pool = _get_ocr_pool()
+    futures: Dict[int, Any] = {i: pool.submit(ocr_page, pdf_path, i, OCR_DPI) for i in pending}
+    for i, future in futures.items():
+        try:
+            contents[i] = ("ocr", future.result())
+        except Exception as e:
+            contents[i] = ("error", str(e))
+
+    ocr_cache.evict()
+    return contents
+
+
+def read_pages_parallel(pdf_path: str, page_count: int) -> List[PageContent]:
+    """read the content of all pages, with page ranges extracted in a process pool"""
+    pool = _get_pool()
+    futures = [pool.submit(extract_page_range, pdf_path, start, end)
+               for start, end in page_ranges(page_count, EXTRACTION_WORKERS)]
+
+    contents = []
+    for future in futures:
+        contents.extend(future.result())
+    return contents
@@ -1,109 +1,80 @@
 import re
 import json
-import time
 import random
-from typing import List, Optional
-from datetime import datetime, timedelta
+from typing import List, Tuple
 from FastAPIProject.config.config_loader import config
 from FastAPIProject.Models.domain.entity import Entity
-from google import genai
+from FastAPIProject.Services.utils.stage_cache import stage_cache
+from FastAPIProject.Services.utils.gemini_gateway import gemini_gateway, GeminiQuotaExceeded
+from FastAPIProject.Services.utils.summary_packing import estimate_tokens, pack_paragraphs
 
 
-class GeminiQuotaManager:
-    """Manages Gemini API quota to stay within free tier limits"""
+GEMINI_MODEL = "gemini-1.5-flash"
+# bump a prompt version whenever its prompt changes, so cached results of the old prompt are not reused
+SUMMARY_PROMPT_VERSION = f"{GEMINI_MODEL}|summary-v1"
+DESCRIPTION_PROMPT_VERSION = f"{GEMINI_MODEL}|description-v1"
 
-    def __init__(self):
-        # Free tier limits (conservative estimates)
-        self.max_requests_per_minute = 10  # Conservative (actual limit is 15)
-        self.max_requests_per_day = 1200  # Conservative (actual limit is 1500)
-        self.max_tokens_per_minute = 25000  # Conservative (actual limit is 32000)
+# a summary request is filled with paragraphs up to this many prompt tokens, and this many paragraphs
+SUMMARY_REQUEST_TOKENS = config["services"]["google_gemini"].get("summary_request_tokens", 2000)
+SUMMARY_REQUEST_PARAGRAPHS = config["services"]["google_gemini"].get("summary_request_paragraphs", 20)
+# the "Paragraph N: " label of each paragraph in the prompt
+PARAGRAPH_LABEL_TOKENS = 4
 
-        # Tracking
-        self.requests_this_minute = []
-        self.requests_today = 0
-        self.tokens_this_minute = []
-        self.last_reset_day = datetime.now().date()
 
-    def can_make_request(self, estimated_tokens: int = 1000) -> tuple[bool, Optional[float]]:
-        """Check if we can make a request and return wait time if needed"""
-        now = datetime.now()
-
-        # Reset daily counter
-        if now.date() > self.last_reset_day:
-            self.requests_today = 0
-            self.last_reset_day = now.date()
-
-        # Clean old requests (older than 1 minute)
-        minute_ago = now - timedelta(minutes=1)
-        self.requests_this_minute = [req_time for req_time in self.requests_this_minute if req_time > minute_ago]
-        self.tokens_this_minute = [(time, tokens) for time, tokens in self.tokens_this_minute if time > minute_ago]
-
-        # Check daily limit
-        if self.requests_today >= self.max_requests_per_day:
-            return False, None  # Need to wait until tomorrow
-
-        # Check per-minute request limit
-        if len(self.requests_this_minute) >= self.max_requests_per_minute:
-            oldest_request = min(self.requests_this_minute)
-            wait_time = 60 - (now - oldest_request).total_seconds()
-            return False, max(wait_time, 1)
-
-        # Check per-minute token limit
-        current_tokens = sum(tokens for _, tokens in self.tokens_this_minute)
-        if current_tokens + estimated_tokens > self.max_tokens_per_minute:
-            if self.tokens_this_minute:
-                oldest_token_time = min(time for time, _ in self.tokens_this_minute)
-                wait_time = 60 - (now - oldest_token_time).total_seconds()
-                return False, max(wait_time, 1)
-
-        return True, 0
+def abstractive_summarization(paragraps_txt: List[str]) -> List[str]:
+    """Summarize paragraphs - only paragraphs without a cached summary are sent to Gemini"""
+    summaries = [stage_cache.get("summary", SUMMARY_PROMPT_VERSION, para) for para in paragraps_txt]
+    missing = [i for i, summary in enumerate(summaries) if summary is None]
+    if not missing:
+        return summaries
 
-    def record_request(self, tokens_used: int = 1000):
-        """Record a successful request"""
-        now = datetime.now()
-        self.requests_this_minute.append(now)
-        self.tokens_this_minute.append((now, tokens_used))
-        self.requests_today += 1
+    new_summaries = summarize_with_quota([paragraps_txt[i] for i in missing])
+    if len(missing) == len(paragraps_txt):
+        # nothing was cached - keep the result as is
+        summaries = list(new_summaries)
+    else:
+        for i, summary in zip(missing, new_summaries):
+            summaries[i] = summary
+        for i in missing[len(new_summaries):]:
+            summaries[i] = f"[Summary unavailable for paragraph {i + 1}]"
 
+    # failed requests return fewer summaries or placeholders - those are not cached
+    if len(new_summaries) == len(missing):
+        for i, summary in zip(missing, new_summaries):
+            if not is_placeholder_summary(summary):
+                stage_cache.set("summary", SUMMARY_PROMPT_VERSION, paragraps_txt[i], summary)
+    return summaries
 
-# Global quota manager instance
-quota_manager = GeminiQuotaManager()
 
+def is_placeholder_summary(summary: str) -> bool:
+    """check if a summary is a placeholder for a paragraph Gemini did not summarize"""
+    return summary.startswith("[Summary") and "unavailable" in summary
 
-def estimate_tokens(text: str) -> int:
-    """Rough estimation of tokens (1 token ≈ 4 characters for English)"""
-    return len(text) // 4
 
+def summarize_with_quota(paragraps_txt: List[str]) -> List[str]:
+    """Quota-aware summarization - the paragraphs are packed into as few requests as the token budget allows"""
+    batches = pack_summary_requests(paragraps_txt)
+    if len(batches) > 1:
+        print(f"Large request ({len(paragraps_txt)} paragraphs) - sending {len(batches)} requests")
+        return process_in_batches(paragraps_txt, batches)
 
-def abstractive_summarization(paragraps_txt: List[str]) -> List[str]:
-    """Quota-aware summarization with intelligent batching"""
+    # the gateway waits for the quota
+    return abstractive_summarization_with_quota(paragraps_txt, summary_request_tokens(paragraps_txt))
 
-    # For free tier, process smaller batches
-    if len(paragraps_txt) > 8:
-        print(f"Large request ({len(paragraps_txt)} paragraphs) - processing in smaller batches for quota management")
-        return process_in_small_batches(paragraps_txt, batch_size=5)
 
-    # Estimate tokens for this request
-    text_content = str(paragraps_txt)
-    estimated_tokens = estimate_tokens(text_content) * 2  # Multiply by 2 for input + output
+def pack_summary_requests(paragraps_txt: List[str]) -> List[Tuple[int, int]]:
+    """the (start, end) paragraph ranges to send in separate summary requests"""
+    return pack_paragraphs(paragraps_txt, SUMMARY_REQUEST_TOKENS, SUMMARY_REQUEST_PARAGRAPHS,
+                           estimate_tokens(summary_prompt([])), PARAGRAPH_LABEL_TOKENS)
 
-    # Check quota before making request
-    can_request, wait_time = quota_manager.can_make_request(estimated_tokens)
 
-    if not can_request:
-        if wait_time is None:
-            print("Daily quota exceeded. Please try again tomorrow.")
-            return []
-        else:
-            print(f"Rate limit reached. Waiting {wait_time:.1f} seconds...")
-            time.sleep(wait_time + 1)  # Add 1 second buffer
+def summary_request_tokens(paragraps_txt: List[str]) -> int:
+    """tokens to reserve in the quota for a summary request"""
+    return estimate_tokens(summary_prompt(paragraps_txt)) * 2  # Multiply by 2 for input + output
 
-    return abstractive_summarization_with_quota(paragraps_txt, estimated_tokens)
-
-
-def abstractive_summarization_with_quota(paragraps_txt: List[str], estimated_tokens: int) -> List[str]:
-    """Summarization with quota tracking"""
 
+def summary_prompt(paragraps_txt: List[str]) -> str:
+    """the prompt asking for one summary per paragraph"""
     # Create numbered list of paragraphs for better tracking
     numbered_paragraphs = [f"Paragraph {i + 1}: {para}" for i, para in enumerate(paragraps_txt)]
 
@@ -117,87 +88,72 @@ Paragraphs to summarize:
 
 Remember: Return exactly {len(paragraps_txt)} summaries in JSON array format.
 """
+    return prompt
 
-    try:
-        client = genai.Client(api_key=config["services"]["google_gemini"]["api_key"])
 
-        response = client.models.generate_content(
-            model="gemini-1.5-flash",
-            contents=[prompt],
-        )
+def parse_summaries(summ: str, expected_count: int) -> List[str]:
+    """parse Gemini's answer to a summary prompt, padded with placeholders to the expected count"""
+    print(f"Raw response: {summ}")
 
-        # Record successful request
-        quota_manager.record_request(estimated_tokens)
-
-        summ = response.candidates[0].content.parts[0].text.strip()
-        print(f"Raw response: {summ}")
+    if not summ:
+        print("Empty response from Gemini")
+        return []
 
-        if not summ:
-            print("Empty response from Gemini")
-            return []
+    parsed_list = parse_gemini_list_response(summ, expected_count=expected_count)
+    print(f"Successfully processed {len(parsed_list)} summaries (expected {expected_count})")
 
-        parsed_list = parse_gemini_list_response(summ, expected_count=len(paragraps_txt))
-        print(f"Successfully processed {len(parsed_list)} summaries (expected {len(paragraps_txt)})")
+    # If we got fewer summaries than expected, pad with placeholders
+    if len(parsed_list) < expected_count:
+        print(f"Warning: Got {len(parsed_list)} summaries but expected {expected_count}")
+        while len(parsed_list) < expected_count:
+            parsed_list.append(f"[Summary unavailable for paragraph {len(parsed_list) + 1}]")
 
-        # If we got fewer summaries than expected, pad with placeholders
-        if len(parsed_list) < len(paragraps_txt):
-            print(f"Warning: Got {len(parsed_list)} summaries but expected {len(paragraps_txt)}")
-            while len(parsed_list) < len(paragraps_txt):
-                parsed_list.append(f"[Summary unavailable for paragraph {len(parsed_list) + 1}]")
+    return parsed_list
 
-        return parsed_list
 
-    except Exception as e:
-        error_str = str(e)
+def abstractive_summarization_with_quota(paragraps_txt: List[str], estimated_tokens: int) -> List[str]:
+    """Summarization with quota tracking"""
+    try:
+        summ = gemini_gateway.generate_sync(summary_prompt(paragraps_txt), GEMINI_MODEL, estimated_tokens)
+        return parse_summaries(summ, len(paragraps_txt))
 
-        if "429" in error_str or "quota" in error_str.lower():
-            print("Quota exceeded - implementing longer delay")
-            # Extract retry delay if provided
-            if "retryDelay" in error_str:
-                import re
-                delay_match = re.search(r"'retryDelay': '(\d+)s'", error_str)
-                if delay_match:
-                    delay = int(delay_match.group(1))
-                    print(f"Waiting {delay} seconds as suggested by API")
-                    time.sleep(delay + 2)  # Add buffer
-            else:
-                time.sleep(60)  # Default 1 minute wait
-
-            return []
+    except GeminiQuotaExceeded as e:
+        print(e)
+        return []
 
+    except Exception as e:
         print(f"Other error: {e}")
         return []
 
 
-def process_in_small_batches(paragraps_txt: List[str], batch_size: int = 5) -> List[str]:
-    """Process in very small batches for quota management"""
-    all_summaries = []
+def process_in_batches(paragraps_txt: List[str], ranges: List[Tuple[int, int]]) -> List[str]:
+    """Process the (start, end) ranges of paragraphs as separate requests, sent to Gemini concurrently within the quota"""
+    batches = [paragraps_txt[start:end] for start, end in ranges]
+    print(f"Processing {len(batches)} batches of {[len(batch) for batch in batches]} paragraphs")
+    answers = gemini_gateway.generate_many_sync(
+        [summary_prompt(batch) for batch in batches],
+        GEMINI_MODEL,
+        [summary_request_tokens(batch) for batch in batches]
+    )
 
-    for i in range(0, len(paragraps_txt), batch_size):
-        batch = paragraps_txt[i:i + batch_size]
-        print(f"Processing batch {i // batch_size + 1} ({len(batch)} paragraphs)")
-
-        try:
-            batch_summaries = abstractive_summarization_with_quota(batch, estimate_tokens(str(batch)) * 2)
-
-            # Ensure we got the right number of summaries
-            if len(batch_summaries) != len(batch):
-                print(f"Warning: Expected {len(batch)} summaries, got {len(batch_summaries)}")
-                # Pad or trim as needed
-                while len(batch_summaries) < len(batch):
-                    batch_summaries.append(f"[Summary unavailable for item {len(batch_summaries) + 1}]")
-                batch_summaries = batch_summaries[:len(batch)]
+    all_summaries = []
+    for batch, answer in zip(batches, answers):
+        if isinstance(answer, Exception):
+            print(f"Batch failed: {answer}")
+            all_summaries.extend([f"[Summary {j + 1} unavailable]" for j in range(len(batch))])
+            continue
 
-            all_summaries.extend(batch_summaries)
+        batch_summaries = parse_summaries(answer, len(batch))
 
-            # Mandatory delay between batches for free tier
-            if i + batch_size < len(paragraps_txt):
-                print("Waiting between batches...")
-                time.sleep(8)  # 8 second delay between batches
+        # Ensure we got the right number of summaries
+        if len(batch_summaries) != len(batch):
+            print(f"Warning: Expected {len(batch)} summaries, got {len(batch_summaries)}")
+            # Pad or trim as needed
+            while len(batch_summaries) < len(batch):
+                batch_summaries.append(f"[Summary unavailable for item {len(batch_summaries) + 1}]")
+            batch_summaries = batch_summaries[:len(batch)]
 
-        except Exception as e:
-            print(f"Batch failed: {e}")
-            all_summaries.extend([f"[Summary {j + 1} unavailable]" for j in range(len(batch))])
+        all_summaries.extend(batch_summaries)
 
     return all_summaries
 
@@ -209,17 +165,6 @@ def api_to_gemini(passage: str, characters: list[Entity]) -> dict[str, dict[str,
     text_content = passage + str([char.name for char in characters])
     estimated_tokens = estimate_tokens(text_content) * 2
 
-    # Check quota
-    can_request, wait_time = quota_manager.can_make_request(estimated_tokens)
-
-    if not can_request:
-        if wait_time is None:
-            print("Daily quota exceeded for character extraction")
-            return {}
-        else:
-            print(f"Waiting {wait_time:.1f} seconds for character extraction...")
-            time.sleep(wait_time + 1)
-
     # Shorter prompt for efficiency
     charsWithNicks = [f"{char.name}" for char in characters]  # Simplified
 
@@ -234,17 +179,7 @@ Passage (first 1000 chars):
 """
 
     try:
-        client = genai.Client(api_key=config["services"]["google_gemini"]["api_key"])
-
-        response = client.models.generate_content(
-            model="gemini-1.5-flash",
-            contents=[prompt],
-        )
-
-        # Record successful request
-        quota_manager.record_request(estimated_tokens)
-
-        text = response.candidates[0].content.parts[0].text.strip()
+        text = gemini_gateway.generate_sync(prompt, GEMINI_MODEL, estimated_tokens)
 
         if text.startswith("```json"):
             text = text.replace("```json", "").replace("```", "").strip()
@@ -258,6 +193,10 @@ Passage (first 1000 chars):
 
         return {}
 
+    except GeminiQuotaExceeded:
+        print("Daily quota exceeded for character extraction")
+        return {}
+
     except Exception as e:
         error_str = str(e)
 
@@ -0,0 +1,194 @@
+import asyncio
+import heapq
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from typing import List, Optional, Sequence
+from zoneinfo import ZoneInfo
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+# waiting requests are served in this order - a user watching a stream goes before background jobs
+PRIORITIES = {INTERACTIVE: 0, BATCH: 1}
+
+# the priority of the requests made in the current context (set to INTERACTIVE while a user waits)
+request_priority: ContextVar[str] = ContextVar("request_priority", default=BATCH)
+
+# a waiting request checks the shared store at least this often, which keeps its waiter row alive
+POLL_SECONDS = 0.25
+MAX_SLEEP_SECONDS = 5.0
+# the waiter rows of a process that stopped checking (e.g. it was killed) are dropped after this
+STALE_WAITER_SECONDS = 30.0
+
+
+class RateLimiter:
+    """token buckets of requests per minute and tokens per minute, and a count of requests per day
+    (of the day in `quota_timezone`, where the provider resets the quota).
+    the state and the queue of waiting requests are kept in a SQLite file, so every process using
+    the same file shares the budgets and the priorities, and the daily count survives restarts"""
+
+    def __init__(self, path: str, name: str, requests_per_minute: int, tokens_per_minute: int,
+                 requests_per_day: int, quota_timezone: str = "America/Los_Angeles"):
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_day = requests_per_day
+        self.quota_timezone = ZoneInfo(quota_timezone)
+        self._lock = threading.Lock()
+        # requests of this process waiting for their turn, as [priority, arrival, wake-up event, waiter id]
+        self._waiting: List[list] = []
+        self._arrivals = itertools.count()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS daily_usage ("
+            "name TEXT NOT NULL, day TEXT NOT NULL, requests INTEGER NOT NULL, PRIMARY KEY (name, day))"
+        )
+        # requests waiting for their turn in every process - served by priority, then by arrival time
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(waiters)")]
+        if columns and "arrival" not in columns:
+            # the queue of an older version - its rows are only of requests waiting right now
+            self._db.execute("DROP TABLE waiters")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS waiters (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, "
+            "priority INTEGER NOT NULL, arrival REAL NOT NULL, pid INTEGER NOT NULL, seen REAL NOT NULL)"
+        )
+
+    def _today(self) -> str:
+        """the current day of the quota"""
+        return datetime.now(self.quota_timezone).date().isoformat()
+
+    def _join(self, priority: int, arrival: float) -> int:
+        """add a waiter to the shared queue - :return its id"""
+        with self._lock:
+            return self._db.execute(
+                "INSERT INTO waiters (name, priority, arrival, pid, seen) VALUES (?, ?, ?, ?, ?)",
+                (self.name, priority, arrival, os.getpid(), time.time())
+            ).lastrowid
+
+    def _leave(self, waiter_id: int):
+        """remove a waiter from the shared queue"""
+        with self._lock:
+            self._db.execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+
+    def try_acquire(self, tokens: int, waiter_id: Optional[int] = None,
+                    alive: Sequence[int] = ()) -> Optional[float]:
+        """take one request and `tokens` tokens if the budgets allow it and no waiter of another process
+        goes before it (any waiter, when called without `waiter_id`) - the order within a process is kept
+        by acquire(). the waiters in `alive` are marked as still waiting.
+        :return 0 when taken, else the seconds to wait before trying again,
+        or None when the daily quota is used up"""
+        # a request larger than the whole minute budget waits for a full bucket instead of forever
+        tokens = min(tokens, self.tokens_per_minute)
+        now = time.time()
+        today = self._today()
+        buckets = ((f"{self.name}:requests", self.requests_per_minute, 1),
+                   (f"{self.name}:tokens", self.tokens_per_minute, tokens))
+
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock, so processes don't spend the same budget twice
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT requests FROM daily_usage WHERE name = ? AND day = ?", (self.name, today)
+                ).fetchone()
+                if row is not None and row[0] >= self.requests_per_day:
+                    self._db.execute("COMMIT")
+                    return None
+
+                self._db.executemany("UPDATE waiters SET seen = ? WHERE id = ?", [(now, i) for i in alive])
+                self._db.execute(
+                    "DELETE FROM waiters WHERE name = ? AND seen < ?", (self.name, now - STALE_WAITER_SECONDS)
+                )
+                if waiter_id is None:
+                    ahead = self._db.execute("SELECT 1 FROM waiters WHERE name = ? LIMIT 1", (self.name,))
+                else:
+                    ahead = self._db.execute(
+                        "SELECT 1 FROM waiters AS other JOIN waiters AS own ON own.id = ? "
+                        "WHERE other.name = own.name AND other.pid != own.pid "
+                        "AND (other.priority, other.arrival, other.id) < (own.priority, own.arrival, own.id) LIMIT 1",
+                        (waiter_id,)
+                    )
+                if ahead.fetchone() is not None:
+                    self._db.execute("COMMIT")
+                    return POLL_SECONDS
+
+                levels, wait = [], 0.0
+                for bucket, capacity, cost in buckets:
+                    row = self._db.execute("SELECT level, updated FROM buckets WHERE name = ?", (bucket,)).fetchone()
+                    # buckets refill continuously, to their capacity per minute
+                    level = capacity if row is None else min(capacity, row[0] + (now - row[1]) * capacity / 60)
+                    levels.append(level)
+                    if level < cost:
+                        wait = max(wait, (cost - level) * 60 / capacity)
+
+                if wait > 0:
+                    self._db.execute("COMMIT")
+                    return wait
+
+                for (bucket, capacity, cost), level in zip(buckets, levels):
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO buckets (name, level, updated) VALUES (?, ?, ?)",
+                        (bucket, level - cost, now)
+                    )
+                self._db.execute(
+                    "INSERT INTO daily_usage (name, day, requests) VALUES (?, ?, 1) "
+                    "ON CONFLICT (name, day) DO UPDATE SET requests = requests + 1",
+                    (self.name, today)
+                )
+                self._db.execute("DELETE FROM daily_usage WHERE name = ? AND day < ?", (self.name, today))
+                if waiter_id is not None:
+                    self._db.execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+                self._db.execute("COMMIT")
+                return 0.0
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    async def acquire(self, tokens: int, priority: str = BATCH) -> bool:
+        """wait until the request fits in the budgets and take it - waiting requests of every process
+        go in priority order, then in arrival order. only the first waiter of this process checks the
+        shared store (in a worker thread, off the event loop). :return False if the daily quota is used up"""
+        # the arrival is taken before the first thread hop, so concurrent calls keep the order they were made in
+        entry = [PRIORITIES[priority], next(self._arrivals), asyncio.Event(), None]
+        heapq.heappush(self._waiting, entry)
+        try:
+            entry[3] = await asyncio.to_thread(self._join, PRIORITIES[priority], time.time())
+            while True:
+                if self._waiting[0] is not entry:
+                    entry[2].clear()
+                    await entry[2].wait()
+                    continue
+
+                alive = [waiting[3] for waiting in self._waiting if waiting[3] is not None]
+                wait = await asyncio.to_thread(self.try_acquire, tokens, entry[3], alive)
+                if wait is None:
+                    return False
+                if wait == 0:
+                    entry[3] = None
+                    return True
+                await asyncio.sleep(min(wait, MAX_SLEEP_SECONDS))
+        finally:
+            self._waiting.remove(entry)
+            heapq.heapify(self._waiting)
+            if self._waiting:
+                self._waiting[0][2].set()
+            if entry[3] is not None:
+                # not taken (quota used up or cancelled) - a row left behind goes stale and is dropped
+                await asyncio.to_thread(self._leave, entry[3])
+
+    def usage_today(self) -> int:
+        """the requests made today by every process sharing the file"""
+        row = self._db.execute(
+            "SELECT requests FROM daily_usage WHERE name = ? AND day = ?", (self.name, self._today())
+        ).fetchone()
+        return row[0] if row else 0
@@ -0,0 +1,35 @@
+from typing import Sequence, Tuple
+
+import numpy as np
+
+Span = Tuple[int, int]
+
+
+def align_spans(mentions: Sequence[Span], spans: Sequence[Span]) -> Tuple[np.ndarray, np.ndarray]:
+    """find every span that overlaps each mention, for all mentions at once.
+    offsets are half-open [start, end); spans may overlap each other and come in any order.
+    :return (mention index, span index) arrays of all overlapping pairs, grouped by mention"""
+    if len(mentions) == 0 or len(spans) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    spans = np.asarray(spans, dtype=np.int64).reshape(-1, 2)
+    order = np.argsort(spans[:, 0], kind="stable")
+    starts = spans[order, 0]
+    ends = spans[order, 1]
+    # furthest end of any span starting at or before each position - non decreasing, so it can be searched
+    reach = np.maximum.accumulate(ends)
+
+    mentions = np.asarray(mentions, dtype=np.int64).reshape(-1, 2)
+    # candidates of a mention: spans that start before it ends, after the last span that could not reach it
+    lo = np.searchsorted(reach, mentions[:, 0], side="right")
+    hi = np.searchsorted(starts, mentions[:, 1], side="left")
+    counts = np.maximum(hi - lo, 0)
+
+    # expand the [lo, hi) range of every mention into flat (mention, candidate) pairs
+    mention_idx = np.repeat(np.arange(len(mentions)), counts)
+    first = np.cumsum(counts) - counts
+    candidates = np.repeat(lo - first, counts) + np.arange(counts.sum())
+
+    # a candidate overlaps unless it ended before the mention (possible when spans are nested)
+    keep = ends[candidates] > mentions[mention_idx, 0]
+    return mention_idx[keep], order[candidates[keep]]
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from FastAPIProject.config.config_loader import config
+
+
+class StageCache:
+    """SQLite cache of pipeline stage outputs, keyed by the hash of the input and the model/prompt version.
+    values are stored as JSON (tuples come back as lists).
+    least recently used entries are evicted when the cache grows past its size limit"""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits: Counter = Counter()
+        self.misses: Counter = Counter()
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, stage TEXT NOT NULL, value BLOB NOT NULL, "
+            "size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self._size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    @staticmethod
+    def key(stage: str, version: str, payload: str) -> str:
+        """cache key of one stage input"""
+        return hashlib.sha256(f"{stage}\0{version}\0{payload}".encode("utf-8")).hexdigest()
+
+    def get(self, stage: str, version: str, payload: str) -> Optional[Any]:
+        """:return the cached output of the stage for this input, or None on a miss"""
+        key = self.key(stage, version, payload)
+        with self._lock:
+            row = self._db.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses[stage] += 1
+                return None
+            try:
+                value = json.loads(row[0])
+            except ValueError:
+                # an entry of an older format - recompute it
+                self.misses[stage] += 1
+                return None
+            self._db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.hits[stage] += 1
+        return value
+
+    def set(self, stage: str, version: str, payload: str, value: Any):
+        """store the output of the stage for this input"""
+        key = self.key(stage, version, payload)
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, stage, value, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, stage, data, len(data), time.time())
+            )
+            self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """delete the least recently used entries until the cache is back under 90% of its limit"""
+        self._size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        target = self.max_bytes * 0.9
+        rows = self._db.execute("SELECT key, size FROM entries ORDER BY last_used").fetchall()
+        stale = []
+        for key, size in rows:
+            if self._size <= target:
+                break
+            stale.append((key,))
+            self._size -= size
+        self._db.executemany("DELETE FROM entries WHERE key = ?", stale)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """hit and miss counters of every stage since startup"""
+        return {
+            stage: {"hits": self.hits[stage], "misses": self.misses[stage]}
+            for stage in sorted(set(self.hits) | set(self.misses))
+        }
+
+
+_cache_config = config.get("cache", {})
+
+# Global stage cache instance
+stage_cache = StageCache(
+    _cache_config.get("path", os.path.join(config["uploads"]["directory"], ".stage_cache.sqlite")),
+    _cache_config.get("max_size_mb", 1024) * 1024 * 1024
+)
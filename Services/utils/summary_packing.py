@@ -0,0 +1,60 @@
+import re
+from functools import lru_cache
+from typing import List, Sequence, Tuple
+
+from FastAPIProject.config.config_loader import config
+
+_gemini_config = config["services"]["google_gemini"]
+# the local tokenizer closest to the model in use (gemini-1.5 shares the SentencePiece vocabulary of 2.0)
+TOKENIZER_MODEL = _gemini_config.get("tokenizer_model", "gemini-2.0-flash")
+# factor of the heuristic, measured against the tokenizer by benchmarks/bench_token_estimate.py
+HEURISTIC_TOKEN_SCALE = _gemini_config.get("heuristic_token_scale", 1.0)
+
+# words, numbers and single punctuation marks
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+@lru_cache(maxsize=None)
+def gemini_tokenizer():
+    """Gemini's SentencePiece tokenizer (the local tokenizer of google-genai, whose model file is downloaded
+    once and cached) - None when it is not installed or cannot be loaded"""
+    try:
+        from google.genai.local_tokenizer import LocalTokenizer
+        return LocalTokenizer(model_name=TOKENIZER_MODEL)
+    except Exception as e:
+        print(f"Gemini tokenizer unavailable ({type(e).__name__}: {e}) - token counts are estimated")
+        return None
+
+
+def heuristic_tokens(text: str) -> int:
+    """rough token count: one token per punctuation mark, one per common word,
+    and about one per 5 characters of longer words (which the tokenizer splits into pieces)"""
+    count = sum(max(1, (match.end() - match.start() + 2) // 5) for match in _TOKEN_PATTERN.finditer(text))
+    return round(count * HEURISTIC_TOKEN_SCALE)
+
+
+def estimate_tokens(text: str) -> int:
+    """the model's token count of the text, counted locally by its tokenizer (or the heuristic without it)"""
+    tokenizer = gemini_tokenizer()
+    if tokenizer is None:
+        return heuristic_tokens(text)
+    return tokenizer.count_tokens(text).total_tokens
+
+
+def pack_paragraphs(texts: Sequence[str], max_tokens: int, max_paragraphs: int,
+                    prompt_tokens: int = 0, paragraph_tokens: int = 0) -> List[Tuple[int, int]]:
+    """split the paragraphs into consecutive (start, end) ranges, one per request, each filled up to
+    `max_tokens` (the prompt's own `prompt_tokens`, plus `paragraph_tokens` of labels per paragraph)
+    and to `max_paragraphs`. a paragraph too large for the budget gets a request of its own"""
+    ranges = []
+    start, used = 0, prompt_tokens
+    for i, text in enumerate(texts):
+        cost = estimate_tokens(text) + paragraph_tokens
+        if i > start and (used + cost > max_tokens or i - start >= max_paragraphs):
+            ranges.append((start, i))
+            start, used = i, prompt_tokens
+        used += cost
+
+    if start < len(texts):
+        ranges.append((start, len(texts)))
+    return ranges
@@ -0,0 +1,49 @@
+from bisect import bisect_right
+
+from FastAPIProject.Models.domain.source_index import SourceIndex, BBox
+
+
+class TextBuilder:
+    """builds the story text from fragments in linear time, tracking offsets and their PDF source"""
+
+    def __init__(self):
+        self._parts: list[str] = []
+        self._starts: list[int] = []  # start offset of every fragment
+        self._words: list[int] = []  # number of words before every fragment
+        self._length = 0
+        self._word_count = 0
+        self.index = SourceIndex()
+
+    def __len__(self) -> int:
+        return self._length
+
+    def append(self, fragment: str, page: int, block: int, bbox: BBox):
+        """append a fragment and record where it came from"""
+        self.index.add(self._length, page, block, bbox)
+        self._parts.append(fragment)
+        self._starts.append(self._length)
+        self._words.append(self._word_count)
+        self._length += len(fragment)
+        self._word_count += len(fragment.split())
+
+    def words_since(self, offset: int) -> int:
+        """number of words from the offset (a fragment boundary) to the end"""
+        if offset >= self._length:
+            return 0
+        i = bisect_right(self._starts, offset) - 1
+        if i < 0:
+            return self._word_count
+        return self._word_count - self._words[i]
+
+    def truncate(self, offset: int):
+        """cut the text back to the offset (a fragment boundary)"""
+        while self._starts and self._starts[-1] >= offset:
+            self._parts.pop()
+            self._starts.pop()
+            self._word_count = self._words.pop()
+        self._length = self._starts[-1] + len(self._parts[-1]) if self._parts else 0
+        self.index.truncate(offset)
+
+    def build(self) -> str:
+        """:return the full text"""
+        return "".join(self._parts)
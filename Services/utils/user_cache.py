@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from FastAPIProject.config.config_loader import config
+
+
+class UserCache:
+    """bounded TTL cache of username -> user id for tokens that do not carry the id,
+    and a read-through cache of the per-user revocation times stored in the database.
+    a revocation made by another process is seen here within `revocation_ttl_seconds`"""
+
+    def __init__(self, max_size: int, ttl_seconds: float, revocation_ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.revocation_ttl_seconds = revocation_ttl_seconds
+        self._users: "OrderedDict[str, tuple[str, float]]" = OrderedDict()
+        # user id -> (revoked at in epoch seconds - 0 if never, expires at)
+        self._revocations: "OrderedDict[str, tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, username: str) -> Optional[str]:
+        """:return the cached user id, or None if it is missing or expired"""
+        with self._lock:
+            entry = self._users.get(username)
+            if entry is None:
+                return None
+            user_id, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._users[username]
+                return None
+            self._users.move_to_end(username)
+            return user_id
+
+    def put(self, username: str, user_id: str):
+        """cache the user id, evicting the least recently used user when full"""
+        with self._lock:
+            self._users[username] = (user_id, time.monotonic() + self.ttl_seconds)
+            self._users.move_to_end(username)
+            while len(self._users) > self.max_size:
+                self._users.popitem(last=False)
+
+    def get_revocation(self, user_id: str) -> Optional[float]:
+        """:return the cached revocation time of the user (0 if never revoked), or None if it is missing or expired"""
+        with self._lock:
+            entry = self._revocations.get(user_id)
+            if entry is None:
+                return None
+            revoked_at, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._revocations[user_id]
+                return None
+            self._revocations.move_to_end(user_id)
+            return revoked_at
+
+    def put_revocation(self, user_id: str, revoked_at: float):
+        """cache the revocation time read from the database, evicting the least recently used user when full"""
+        with self._lock:
+            self._revocations[user_id] = (revoked_at, time.monotonic() + self.revocation_ttl_seconds)
+            self._revocations.move_to_end(user_id)
+            while len(self._revocations) > self.max_size:
+                self._revocations.popitem(last=False)
+
+    def revoke(self, user_id: str, revoked_at: float):
+        """cache a revocation stored by this process right away, and forget the cached user"""
+        self.put_revocation(user_id, revoked_at)
+        with self._lock:
+            for username in [name for name, (uid, _) in self._users.items() if uid == user_id]:
+                del self._users[username]
+
+
+_auth_config = config.get("auth", {})
+
+# Global user cache instance
+user_cache = UserCache(
+    _auth_config.get("user_cache_size", 10000),
+    _auth_config.get("user_cache_ttl_seconds", 300),
+    _auth_config.get("revocation_cache_ttl_seconds", 10)
+)
@@ -0,0 +1,75 @@
+from typing import Dict, List, Tuple
+
+Span = Tuple[int, int]
+Cluster = Tuple[List[str], List[Span]]
+
+
+def split_windows(text: str, window: int, overlap: int) -> List[Span]:
+    """split the text into overlapping [start, end) windows of at most `window` characters,
+    cutting at whitespace where possible"""
+    if len(text) <= window:
+        return [(0, len(text))]
+
+    overlap = min(overlap, window // 2)
+    windows = []
+    start = 0
+    while True:
+        end = min(start + window, len(text))
+        if end < len(text):
+            # end the window on whitespace, but keep more than the overlap in it
+            cut = text.rfind(" ", start + overlap + 1, end)
+            if cut != -1:
+                end = cut
+        windows.append((start, end))
+        if end >= len(text):
+            return windows
+
+        # start the next window inside the overlap, on a word boundary
+        next_start = end - overlap
+        space = text.find(" ", next_start, end)
+        start = space + 1 if space != -1 else next_start
+
+
+def owned_ranges(windows: List[Span]) -> List[Span]:
+    """the part of the text each window is responsible for - overlaps are split at their middle"""
+    owned = []
+    for i, (start, end) in enumerate(windows):
+        own_start = 0 if i == 0 else (windows[i - 1][1] + start) // 2
+        own_end = end if i == len(windows) - 1 else (end + windows[i + 1][0]) // 2
+        owned.append((own_start, own_end))
+    return owned
+
+
+def merge_window_clusters(window_clusters: List[List[Cluster]]) -> List[Cluster]:
+    """merge coreference clusters of overlapping windows (offsets already global): clusters that share
+    a mention span are joined, and mentions found by several windows are kept once"""
+    nodes = [cluster for clusters in window_clusters for cluster in clusters]
+    parent = list(range(len(nodes)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    # join every cluster with the first cluster that had the same mention span
+    span_owner: Dict[Span, int] = {}
+    for node, (_, spans) in enumerate(nodes):
+        for span in spans:
+            if span in span_owner:
+                parent[find(node)] = find(span_owner[span])
+            else:
+                span_owner[span] = node
+
+    merged: Dict[int, Dict[Span, str]] = {}
+    for node, (texts, spans) in enumerate(nodes):
+        mentions = merged.setdefault(find(node), {})
+        for text, span in zip(texts, spans):
+            mentions.setdefault(span, text)
+
+    clusters = []
+    for mentions in merged.values():
+        spans = sorted(mentions)
+        clusters.append(([mentions[span] for span in spans], spans))
+    clusters.sort(key=lambda cluster: cluster[1][0])
+    return clusters
@@ -0,0 +1,71 @@
+"""Compare aligning coreference mentions to NER spans with textranker's IntervalTree and with align_spans.
+
+usage: python -m FastAPIProject.benchmarks.bench_alignment [mentions] [ner_spans]
+"""
+import random
+import sys
+import time
+
+from FastAPIProject.Services.utils.span_alignment import align_spans
+
+
+def synthetic_chapter(n_mentions, n_spans, seed=0):
+    """random non-overlapping NER spans and coreference mentions over a chapter-sized offset range"""
+    rng = random.Random(seed)
+    length = 40 * (n_mentions + n_spans)
+
+    def spans(n):
+        starts = sorted(rng.sample(range(0, length, 20), n))
+        return [(start, start + rng.randint(3, 19)) for start in starts]
+
+    return spans(n_mentions), spans(n_spans)
+
+
+def interval_tree_path(mentions, ner_spans):
+    """the previous alignment: one tree insert per NER span, one overlapSearch (first overlap only) per mention"""
+    from textranker import Interval, IntervalTree
+
+    tree = IntervalTree()
+    for start, end in ner_spans:
+        tree.insert(Interval(start, end))
+
+    pairs = []
+    for i, (start, end) in enumerate(mentions):
+        result = tree.overlapSearch(Interval(start, end))
+        if result is not None:
+            pairs.append((i, (result["interval"].low, result["interval"].high)))
+    return pairs
+
+
+def brute_force(mentions, ner_spans):
+    return [(i, j) for i, (ms, me) in enumerate(mentions) for j, (ns, ne) in enumerate(ner_spans)
+            if ns < me and ne > ms]
+
+
+def main():
+    n_mentions = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    n_spans = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+    mentions, ner_spans = synthetic_chapter(n_mentions, n_spans)
+
+    start = time.perf_counter()
+    mention_idx, span_idx = align_spans(mentions, ner_spans)
+    after_time = time.perf_counter() - start
+    pairs = list(zip(mention_idx.tolist(), span_idx.tolist()))
+
+    print(f"mentions: {n_mentions}, NER spans: {n_spans}, overlapping pairs: {len(pairs)}")
+    print(f"align_spans:  {after_time * 1000:.2f}ms")
+
+    try:
+        start = time.perf_counter()
+        tree_pairs = interval_tree_path(mentions, ner_spans)
+        before_time = time.perf_counter() - start
+        print(f"IntervalTree: {before_time * 1000:.2f}ms ({len(tree_pairs)} first overlaps)")
+    except ImportError:
+        print("IntervalTree: textranker is not installed")
+
+    if n_mentions * n_spans <= 25_000_000:
+        print(f"matches brute force: {sorted(pairs) == brute_force(mentions, ner_spans)}")
+
+
+if __name__ == "__main__":
+    main()
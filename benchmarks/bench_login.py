@@ -0,0 +1,103 @@
+"""Measure login throughput and event loop stalls with bcrypt run on the event loop (before)
+and in the hashing thread pool (after).
+
+usage: python -m FastAPIProject.benchmarks.bench_login [logins] [concurrency] [rounds]
+users are kept in memory instead of Mongo, so the numbers are the hashing cost only
+"""
+import asyncio
+import sys
+import time
+
+from passlib.context import CryptContext
+
+from FastAPIProject.Models.api.user import UserCreate, UserInDB
+from FastAPIProject.Services import auth_service as auth_service_module
+from FastAPIProject.Services.auth_service import AuthService
+from FastAPIProject.Services.utils import auth
+from FastAPIProject.Services.utils.auth import PasswordHashingBusy
+
+
+class InMemoryUserRepository:
+    """the user repository methods used by login, over a dict"""
+
+    def __init__(self):
+        self.users = {}
+
+    async def get_user_by_email(self, email):
+        return self.users.get(email)
+
+    async def create_user(self, user: UserCreate, hashed_password: str) -> UserInDB:
+        self.users[user.email] = UserInDB(**user.model_dump(exclude={"password"}), hashed_password=hashed_password)
+        return self.users[user.email]
+
+    async def update_password_hash(self, user_id, hashed_password):
+        for user in self.users.values():
+            if str(user.id) == user_id:
+                user.hashed_password = hashed_password
+                return True
+        return False
+
+
+async def verify_on_loop(plain_password, hashed_password):
+    """the login path before the change - bcrypt called directly inside the coroutine"""
+    return auth.pwd_context.verify(plain_password, hashed_password), None
+
+
+async def watch_loop_lag(stop, interval=0.01):
+    """:return the longest time the event loop was late to wake a sleeping task"""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def run_logins(service, users, logins, concurrency):
+    """:return (seconds, successful logins, rejected logins, worst loop lag)"""
+    limit = asyncio.Semaphore(concurrency)
+    results = {"ok": 0, "busy": 0}
+
+    async def login(i):
+        email = users[i % len(users)]
+        async with limit:
+            try:
+                await service.authenticate_user(email, "password")
+                results["ok"] += 1
+            except PasswordHashingBusy:
+                results["busy"] += 1
+
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch_loop_lag(stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(login(i) for i in range(logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    return elapsed, results["ok"], results["busy"], await watcher
+
+
+async def main():
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else auth.BCRYPT_ROUNDS
+    auth.pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+
+    service = AuthService.__new__(AuthService)
+    service.user_repository = InMemoryUserRepository()
+    users = []
+    for i in range(8):
+        user = UserCreate(username=f"user{i}", email=f"user{i}@example.com", password="password")
+        await service.user_repository.create_user(user, auth.get_password_hash(user.password))
+        users.append(user.email)
+
+    print(f"logins: {logins}, concurrency: {concurrency}, bcrypt rounds: {rounds}, "
+          f"hash workers: {auth.HASH_WORKERS}, max pending: {auth.HASH_MAX_PENDING}")
+    for label, verify in (("before", verify_on_loop), ("after", auth.verify_and_update_password)):
+        auth_service_module.verify_and_update_password = verify
+        elapsed, ok, busy, lag = await run_logins(service, users, logins, concurrency)
+        print(f"{label}: {ok / elapsed:.1f} logins/s, {busy} rejected as busy, "
+              f"worst event loop lag {lag * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
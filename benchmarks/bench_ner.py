@@ -0,0 +1,39 @@
+"""Compare per-chapter full-pipeline NER with batched, trimmed NER.
+
+usage: python -m FastAPIProject.benchmarks.bench_ner book.pdf
+"""
+import sys
+import time
+
+from FastAPIProject.Services.story_processor import StoryProcessor
+from FastAPIProject.Services.utils.model_registry import models
+from FastAPIProject.Services.utils.ner import ner_batch_local
+
+
+def per_chapter_full_pipeline(chapters):
+    """the previous ner(): one nlp() call per chapter with every component enabled"""
+    nlp = models.get("spacy")
+    return [[(ent.text, ent.label_, ent.start_char, ent.end_char) for ent in nlp(chapter).ents]
+            for chapter in chapters]
+
+
+def main():
+    text, chapters, _ = StoryProcessor().text_from_pdf(sys.argv[1])
+    chapter_texts = [text[start:end].strip() for start, end in chapters]
+
+    start = time.perf_counter()
+    before = per_chapter_full_pipeline(chapter_texts)
+    before_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    after = ner_batch_local(chapter_texts)
+    after_time = time.perf_counter() - start
+
+    print(f"chapters: {len(chapter_texts)}, characters: {sum(len(c) for c in chapter_texts)}")
+    print(f"before: {len(chapter_texts) / before_time:.2f} chapters/s ({before_time:.1f}s)")
+    print(f"after:  {len(chapter_texts) / after_time:.2f} chapters/s ({after_time:.1f}s)")
+    print(f"identical entities: {before == after}")
+
+
+if __name__ == "__main__":
+    main()
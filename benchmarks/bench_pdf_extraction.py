@@ -0,0 +1,56 @@
+"""Compare serial and parallel PDF text extraction by page count.
+
+usage: python -m FastAPIProject.benchmarks.bench_pdf_extraction book.pdf [page counts...]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import fitz  # PyMuPDF
+
+from FastAPIProject.Services.story_processor import StoryProcessor
+
+
+def truncated_copy(pdf_path: str, pages: int) -> str:
+    """write the first pages of the PDF to a temporary file"""
+    src = fitz.open(pdf_path)
+    dst = fitz.open()
+    dst.insert_pdf(src, from_page=0, to_page=min(pages, src.page_count) - 1)
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    dst.save(path)
+    dst.close()
+    src.close()
+    return path
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    pdf_path = sys.argv[1]
+    page_counts = [int(n) for n in sys.argv[2:]] or [16, 64, 256, 512]
+    processor = StoryProcessor()
+
+    # warm up the process pool so its startup is not counted
+    processor.text_from_pdf(truncated_copy(pdf_path, 1), parallel=True)
+
+    print(f"{'pages':>6} {'serial (s)':>11} {'parallel (s)':>13} {'speedup':>8} identical")
+    for pages in page_counts:
+        path = truncated_copy(pdf_path, pages)
+        try:
+            serial, serial_time = timed(processor.text_from_pdf, path, parallel=False)
+            parallel, parallel_time = timed(processor.text_from_pdf, path, parallel=True)
+        finally:
+            os.remove(path)
+
+        print(f"{pages:>6} {serial_time:>11.2f} {parallel_time:>13.2f} "
+              f"{serial_time / parallel_time:>7.1f}x {serial == parallel}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Compare the per-request overhead of the list and get story endpoints when every request constructs
+its StoryService (before) and when the app's service container is injected (after).
+
+usage: python -m FastAPIProject.benchmarks.bench_service_container [requests]
+the repository reads return in-memory results, so the database round trip is not part of the numbers
+"""
+import asyncio
+import sys
+import time
+from datetime import datetime
+
+from bson import ObjectId
+from fastapi import FastAPI
+
+from FastAPIProject.API.dependencies import get_story_service
+from FastAPIProject.API.story_router import router, get_current_user_id
+from FastAPIProject.Repositories.database import Database
+from FastAPIProject.Repositories.story_repository import StoryRepository
+from FastAPIProject.Services.container import ServiceContainer
+from FastAPIProject.Services.story_service import StoryService
+
+USER_ID = "benchmark"
+STORY_ID = str(ObjectId())
+
+
+async def stories_page(self, user_id, after=None, limit=50):
+    now = datetime.now()
+    return [{"_id": ObjectId(), "title": f"Story {i}", "user_id": user_id, "created_at": now, "updated_at": now,
+             "chapters_count": 10, "entities_count": 40} for i in range(limit)]
+
+
+async def story_by_id(self, story_id):
+    now = datetime.now()
+    return {"_id": ObjectId(story_id), "title": "Story", "user_id": USER_ID, "created_at": now, "updated_at": now,
+            "text": "text " * 1000, "entities": [], "key_paragraphs": []}
+
+
+async def call(app, path, query=b""):
+    """send one GET request straight to the ASGI app and return the status code"""
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query,
+             "root_path": "", "headers": [], "client": ("127.0.0.1", 0), "server": ("127.0.0.1", 80), "app": app}
+    response = {}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+
+    await app(scope, receive, send)
+    return response["status"]
+
+
+async def timed_requests(app, path, query, n):
+    """:return the mean seconds per request"""
+    assert await call(app, path, query) == 200
+    start = time.perf_counter()
+    for _ in range(n):
+        await call(app, path, query)
+    return (time.perf_counter() - start) / n
+
+
+def timed_construction(n):
+    start = time.perf_counter()
+    for _ in range(n):
+        StoryService()
+    return (time.perf_counter() - start) / n
+
+
+async def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    await Database.connect_db()
+    StoryRepository.get_stories_by_user_id = stories_page
+    StoryRepository.get_story_by_id = story_by_id
+
+    app = FastAPI()
+    app.include_router(router)
+    app.state.container = ServiceContainer()
+    app.dependency_overrides[get_current_user_id] = lambda: USER_ID
+
+    construct = min(timed_construction(200) for _ in range(5))
+    print(f"requests: {n}, StoryService() construction: {construct * 1e6:.1f}us")
+    for label, override in (("before", lambda: StoryService()), ("after", None)):
+        if override:
+            app.dependency_overrides[get_story_service] = override
+        else:
+            app.dependency_overrides.pop(get_story_service, None)
+        list_time = await timed_requests(app, "/stories/", b"limit=50", n)
+        get_time = await timed_requests(app, f"/stories/{STORY_ID}", b"", n)
+        print(f"{label}: list {list_time * 1e6:.0f}us/request, get {get_time * 1e6:.0f}us/request")
+
+    await Database.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+"""Compare the stored size and fetch/decode time of a large story with coreference positions
+as arrays of [start, end] pairs (before) and as packed int32 binary (after).
+
+usage: python -m FastAPIProject.benchmarks.bench_story_storage [entities] [mentions_per_entity] [--mongo]
+with --mongo both documents are also written to and fetched from the configured database
+"""
+import random
+import sys
+import time
+
+import bson
+
+from FastAPIProject.Models.domain.packed_positions import pack_positions, unpack_positions
+
+
+def synthetic_story(n_entities, mentions, seed=0):
+    """story document with n_entities entities of `mentions` positions each, positions as [start, end] arrays"""
+    rng = random.Random(seed)
+    entities = []
+    for i in range(n_entities):
+        starts = sorted(rng.sample(range(0, 2_000_000), mentions))
+        entities.append({
+            "name": f"Entity {i}",
+            "label": "PERSON",
+            "nicknames": ["he"] * (mentions - 1),
+            "coref_position": [[start, start + rng.randint(2, 20)] for start in starts],
+            "chapters": [[0, 0, mentions]],
+            "description": {"hair": "dark"},
+        })
+    return {"title": "benchmark", "user_id": "benchmark", "entities": entities}
+
+
+def packed(story):
+    entities = [dict(entity, coref_position=pack_positions(entity["coref_position"])) for entity in story["entities"]]
+    return dict(story, entities=entities)
+
+
+def decode(data, unpack):
+    story = bson.decode(data)
+    if unpack:
+        for entity in story["entities"]:
+            entity["coref_position"] = unpack_positions(entity["coref_position"])
+    return story
+
+
+def timed(func, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def mongo_fetch(before, after):
+    from pymongo import MongoClient
+    from FastAPIProject.config.config_loader import config
+
+    collection = MongoClient(config["database"]["uri"])[config["database"]["name"]]["bench_story_storage"]
+    try:
+        for label, story in (("before", before), ("after", after)):
+            story_id = collection.insert_one(dict(story)).inserted_id
+            fetch_time = timed(lambda: collection.find_one({"_id": story_id}))
+            print(f"{label} fetch:  {fetch_time * 1000:.1f}ms")
+    finally:
+        collection.drop()
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    n_entities = int(args[0]) if len(args) > 0 else 300
+    mentions = int(args[1]) if len(args) > 1 else 300
+
+    before = synthetic_story(n_entities, mentions)
+    after = packed(before)
+    before_data = bson.encode(before)
+    after_data = bson.encode(after)
+
+    print(f"entities: {n_entities}, mentions per entity: {mentions}")
+    print(f"before size:   {len(before_data) / 1024 / 1024:.2f}MB")
+    print(f"after size:    {len(after_data) / 1024 / 1024:.2f}MB")
+    print(f"before decode: {timed(lambda: decode(before_data, False)) * 1000:.1f}ms")
+    print(f"after decode:  {timed(lambda: decode(after_data, False)) * 1000:.1f}ms (positions left packed)")
+    print(f"after decode:  {timed(lambda: decode(after_data, True)) * 1000:.1f}ms (positions unpacked)")
+
+    unpacked = decode(after_data, True)["entities"]
+    print(f"identical positions: "
+          f"{all(list(map(tuple, b['coref_position'])) == a['coref_position'] for b, a in zip(before['entities'], unpacked))}")
+
+    if "--mongo" in sys.argv:
+        mongo_fetch(before, after)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Compare the number of summary requests per chapter with the fixed batching (one request up to 8 paragraphs,
+else batches of 5) and with token-budget packing, and how many requests go over the token budget.
+
+usage: python -m FastAPIProject.benchmarks.bench_summary_packing [book.pdf]
+without a PDF a synthetic corpus of chapters with mixed paragraph lengths is used.
+the token counts are the tokenizer's when it is available - check the heuristic with bench_token_estimate otherwise
+"""
+import random
+import sys
+
+from FastAPIProject.Services.utils.pegasus_xsum import (
+    SUMMARY_REQUEST_TOKENS, pack_summary_requests, summary_prompt
+)
+from FastAPIProject.Services.utils.summary_packing import estimate_tokens, gemini_tokenizer
+
+WORDS = ("the", "she", "looked", "across", "river", "where", "lantern", "flickered", "remembered",
+         "extraordinarily", "whispered", "and", "of", "Jerusalem", "never", "again", "beneath", "storm")
+
+
+def synthetic_chapters(n_chapters=40, seed=0):
+    """chapters of 3-40 paragraphs - mostly short, some long and a few very long"""
+    rng = random.Random(seed)
+    chapters = []
+    for _ in range(n_chapters):
+        paragraphs = []
+        for _ in range(rng.randint(3, 40)):
+            words = int(rng.lognormvariate(4.0, 0.9))
+            text = " ".join(rng.choice(WORDS) for _ in range(max(words, 3)))
+            paragraphs.append(text.capitalize() + ".")
+        chapters.append(paragraphs)
+    return chapters
+
+
+def pdf_chapters(path):
+    """the paragraphs of each chapter of a PDF"""
+    from FastAPIProject.Services.story_processor import StoryProcessor
+
+    text, chapters, paragraphs = StoryProcessor().text_from_pdf(path)
+    return [[text[start:end].strip() for start, end in paragraphs if chapter_start <= start < chapter_end]
+            for chapter_start, chapter_end in chapters]
+
+
+def fixed_batches(paragraphs):
+    """the previous batching of summarize_with_quota"""
+    if len(paragraphs) <= 8:
+        return [paragraphs]
+    return [paragraphs[i:i + 5] for i in range(0, len(paragraphs), 5)]
+
+
+def main():
+    chapters = pdf_chapters(sys.argv[1]) if len(sys.argv) > 1 else synthetic_chapters()
+    chapters = [paragraphs for paragraphs in chapters if paragraphs]
+
+    before = [batch for paragraphs in chapters for batch in fixed_batches(paragraphs)]
+    after = [paragraphs[start:end] for paragraphs in chapters for start, end in pack_summary_requests(paragraphs)]
+
+    print(f"chapters: {len(chapters)}, paragraphs: {sum(len(paragraphs) for paragraphs in chapters)}, "
+          f"token budget: {SUMMARY_REQUEST_TOKENS}, "
+          f"token counts: {'tokenizer' if gemini_tokenizer() is not None else 'heuristic'}")
+    for label, batches in (("before", before), ("after", after)):
+        tokens = [estimate_tokens(summary_prompt(batch)) for batch in batches]
+        over = [t for batch, t in zip(batches, tokens) if t > SUMMARY_REQUEST_TOKENS]
+        single = sum(1 for batch, t in zip(batches, tokens) if t > SUMMARY_REQUEST_TOKENS and len(batch) == 1)
+        print(f"{label}: {len(batches)} requests, {sum(tokens)} prompt tokens, "
+              f"mean {sum(tokens) / len(tokens):.0f} / max {max(tokens)} tokens per request, "
+              f"{len(over)} over budget ({single} of them a single paragraph)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Measure the error of the heuristic token count against Gemini's tokenizer, on the paragraphs and on the
+summary prompts of a corpus, and the heuristic_token_scale that removes its bias.
+
+usage: python -m FastAPIProject.benchmarks.bench_token_estimate [book.pdf] [--api]
+the reference is the local tokenizer, or with --api the count_tokens endpoint of the model in use.
+without a PDF the synthetic corpus of bench_summary_packing is used - calibrate on a real book
+"""
+import sys
+
+from FastAPIProject.benchmarks.bench_summary_packing import pdf_chapters, synthetic_chapters
+from FastAPIProject.config.config_loader import config
+from FastAPIProject.Services.utils.pegasus_xsum import GEMINI_MODEL, pack_summary_requests, summary_prompt
+from FastAPIProject.Services.utils.summary_packing import (
+    HEURISTIC_TOKEN_SCALE, TOKENIZER_MODEL, gemini_tokenizer, heuristic_tokens
+)
+
+
+def reference_counter(use_api):
+    """:return (name, function counting the tokens of a text the way the model does)"""
+    if use_api:
+        from google import genai
+
+        client = genai.Client(api_key=config["services"]["google_gemini"]["api_key"])
+        return f"count_tokens of {GEMINI_MODEL}", \
+            lambda text: client.models.count_tokens(model=GEMINI_MODEL, contents=text).total_tokens
+
+    tokenizer = gemini_tokenizer()
+    if tokenizer is None:
+        sys.exit("the local tokenizer is not available - install google-genai and sentencepiece, or use --api")
+    return f"local tokenizer of {TOKENIZER_MODEL}", lambda text: tokenizer.count_tokens(text).total_tokens
+
+
+def report(label, texts, count):
+    """print the error of the heuristic over the texts - :return (heuristic, reference) token totals"""
+    estimated = [heuristic_tokens(text) for text in texts]
+    actual = [count(text) for text in texts]
+    errors = [(e - a) / a for e, a in zip(estimated, actual) if a]
+    under = sum(1 for error in errors if error < -0.1)
+    print(f"{label}: {len(texts)} texts, {sum(actual)} tokens, heuristic/actual {sum(estimated) / sum(actual):.3f}, "
+          f"mean abs error {sum(abs(error) for error in errors) / len(errors):.1%}, "
+          f"error from {min(errors):+.1%} to {max(errors):+.1%}, {under} under by more than 10%")
+    return sum(estimated), sum(actual)
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if arg != "--api"]
+    chapters = pdf_chapters(args[0]) if args else synthetic_chapters()
+    chapters = [paragraphs for paragraphs in chapters if paragraphs]
+
+    name, count = reference_counter("--api" in sys.argv)
+    print(f"reference: {name}, heuristic_token_scale: {HEURISTIC_TOKEN_SCALE}")
+
+    paragraphs = [paragraph for chapter in chapters for paragraph in chapter]
+    prompts = [summary_prompt(chapter[start:end]) for chapter in chapters
+               for start, end in pack_summary_requests(chapter)]
+    report("paragraphs", paragraphs, count)
+    estimated, actual = report("summary prompts", prompts, count)
+    print(f"unbiased heuristic_token_scale: {HEURISTIC_TOKEN_SCALE * actual / estimated:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,14 @@
 import sys
 import os
+import asyncio
 import threading
 import winsound
 from contextlib import asynccontextmanager
 
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, status
 from fastapi.middleware.cors import CORSMiddleware
-from transformers import DebertaV2Model
+from fastapi.responses import JSONResponse
 
 # Add project paths to Python path
 sys.path.append(os.path.dirname(__file__))
@@ -23,15 +24,11 @@ sys.path.append(os.path.abspath(config["services"]["textRank"]["path"]))
 from .API.endpoints import router as auth_router
 from .API.story_router import router as story_router
 from .Repositories.database import Database
-
-
-# Patch for DebertaV2Model - fix hidden_size property
-def _patched_hidden_size(self):
-    """Patch to fix DebertaV2Model hidden_size property"""
-    return self.config.hidden_size
-
-
-DebertaV2Model.hidden_size = property(_patched_hidden_size)
+from .Services.container import ServiceContainer
+from .Services.job_queue import job_queue
+from .Services.utils.model_registry import models
+from .Services.utils.inference import inference_client
+from .Services.utils.stage_cache import stage_cache
 
 
 def play_startup_sound():
@@ -50,12 +47,26 @@ async def lifespan(app: FastAPI):
     # Startup: Connect to database
     await Database.connect_db()
     print("Connected to MongoDB!")
+    await Database.ensure_indexes()
+
+    # Startup: the services and repositories shared by all requests (see API/dependencies.py)
+    app.state.container = ServiceContainer()
+
+    # Startup: start the background story-processing workers
+    await job_queue.start(app.state.container.story_service, app.state.container.job_repository)
+
+    # Startup: load the NLP models in the background - the API serves requests meanwhile (see /ready)
+    if config["services"].get("warmup_on_startup", True):
+        asyncio.get_running_loop().run_in_executor(None, models.warmup)
 
     # Play startup sound in a separate thread to avoid blocking the server startup
     threading.Thread(target=play_startup_sound, daemon=True).start()
 
     yield
 
+    # Shutdown: stop the background workers
+    await job_queue.stop()
+
     # Shutdown: Close database connection
     await Database.close_db()
     print("Disconnected from MongoDB!")
@@ -76,6 +87,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # pagination cursor of GET /stories/
 )
 
 # Include routers
@@ -94,6 +106,22 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy"}
 
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness endpoint - ready once every model is loaded and the inference server (if any) answers"""
+    ready = models.is_ready()
+    content = {"models": models.status(), "stage_cache": stage_cache.stats()}
+    if inference_client is not None:
+        # checked live (the result is cached for a few seconds), so a server that starts late or dies is noticed
+        up, error = await asyncio.to_thread(inference_client.check)
+        content["inference_server"] = {"up": up, "error": error}
+        ready = ready and up
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"status": "ready" if ready else "loading", **content}
+    )
+
 # Run application (uncomment for direct execution)
 # if __name__ == "__main__":
 #     uvicorn.run("FastAPIProject.__main__:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file